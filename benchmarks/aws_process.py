@@ -0,0 +1,40 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Time fwunit.aws.process.get_rules on a synthetic AWS account"""
+
+import argparse
+import time
+from fwunit import common
+from fwunit.aws import process
+from fwunit.test.util.aws_account import synthetic_account
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--instances', type=int, default=2000)
+    parser.add_argument('--security-groups', type=int, default=100)
+    parser.add_argument('--subnets', type=int, default=64)
+    parser.add_argument('--apps', type=int, default=20,
+                        help="number of additional apps in the application map")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    snapshot = synthetic_account(instances=args.instances,
+                                 security_groups=args.security_groups,
+                                 subnets=args.subnets, seed=args.seed)
+    application_map = {'22/tcp': 'ssh', '80-81/tcp': 'http', '443/tcp': 'https'}
+    for i in range(args.apps):
+        application_map['{}/tcp'.format(5000 + i)] = 'app{}'.format(i)
+    app_map = common.ApplicationMap({'application-map': application_map})
+
+    start = time.time()
+    rules = process.get_rules(snapshot, app_map, None, ['dynamic'])
+    print "{} instances, {} security groups: {} rules for {} apps in {:.2f}s".format(
+        args.instances, args.security_groups,
+        sum(len(r) for r in rules.itervalues()), len(rules), time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Time fwunit.combine.process.combine on synthetic sources"""
+
+import argparse
+import time
+from fwunit.combine import process
+from fwunit.test.util import combine_sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, default=5000,
+                        help="number of rules in each source")
+    parser.add_argument('--apps', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sources = combine_sources.synthetic_sources(
+        rules=args.rules, apps=args.apps, seed=args.seed)
+    start = time.time()
+    rules = process.combine(combine_sources.ADDRESS_SPACES,
+                            combine_sources.ROUTES, sources)
+    print "{} rules per source: {} rules for {} apps in {:.2f}s".format(
+        args.rules, sum(len(r) for r in rules.itervalues()), len(rules),
+        time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
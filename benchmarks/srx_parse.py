@@ -0,0 +1,78 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Time downloading and parsing SRX policies from a simulated firewall, with
+each policy_download mode"""
+
+import argparse
+import time
+from fwunit.srx import parse
+from fwunit.test.util.srx_xml import FakeSRX
+
+
+class SlowSRX(FakeSRX):
+    """A FakeSRX which takes `latency` seconds to answer each request"""
+
+    def __init__(self, latency):
+        super(SlowSRX, self).__init__()
+        self.latency = latency
+
+    def fake_show(self, request):
+        time.sleep(self.latency)
+        return super(SlowSRX, self).fake_show(request)
+
+
+def make_firewall(zones, policies, latency):
+    srx = SlowSRX(latency)
+    zone_names = ['zone{}'.format(i) for i in range(zones)]
+    for i, name in enumerate(zone_names):
+        z = srx.add_zone(name)
+        srx.add_interface(z, 'reth{}'.format(i))
+        srx.add_address(z, 'host{}'.format(i), '10.{}.0.1/32'.format(i))
+    for from_zone in zone_names:
+        for to_zone in zone_names:
+            for seq in range(policies):
+                srx.add_policy((from_zone, to_zone), dict(
+                    sequence=seq, name='policy{}'.format(seq), src='any',
+                    dst='any', app='junos-ssh', action='permit'))
+    srx.add_policy('global', dict(
+        sequence=1, name='ping', src='any', dst='any', app='junos-ping',
+        action='permit'))
+    return srx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--zones', type=int, default=10)
+    parser.add_argument('--policies', type=int, default=5,
+                        help="number of policies for each zone pair")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="simulated seconds per request")
+    parser.add_argument('--throttle', type=float, default=1.0)
+    args = parser.parse_args()
+
+    srx = make_firewall(args.zones, args.policies, args.latency)
+    srx.install()
+    try:
+        for download in 'zone-pairs', 'all':
+            cfg = {
+                'firewall': 'fw',
+                'ssh_username': 'uu',
+                'ssh_password': 'pp',
+                'throttle': args.throttle,
+                'policy_download': download,
+            }
+            del srx.requests[:]
+            start = time.time()
+            firewall = parse.Firewall()
+            firewall.parse(cfg)
+            print "{}: {} policies from {} requests in {:.2f}s".format(
+                download, len(firewall.policies), len(srx.requests),
+                time.time() - start)
+    finally:
+        srx.uninstall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# A persistent, cross-process cache of decoded rule files.  JSON rule files
+# are slow to decode, so the first process to load one stores a copy in the
+# binary rule format, keyed by a hash of the JSON content, and later
+# processes load that copy instead.
+
+import hashlib
+import logging
+import os
+import tempfile
+
+from fwunit import rulefile
+
+log = logging.getLogger(__name__)
+
+# bump this if the binary format or the conversion changes
+VERSION = '1'
+
+
+def cache_dir():
+    """Return the cache directory, or None if the cache is disabled.  Set
+    $FWUNIT_CACHE_DIR to change the directory, or to an empty string to
+    disable caching."""
+    dir = os.environ.get('FWUNIT_CACHE_DIR')
+    if dir is None:
+        dir = os.path.join(os.path.expanduser('~'), '.cache', 'fwunit')
+    return dir or None
+
+
+def max_size():
+    """Return the maximum total size of the cache, in bytes.  Set
+    $FWUNIT_CACHE_MB to change it; the default is 1024."""
+    return int(os.environ.get('FWUNIT_CACHE_MB', 1024)) * 1024 * 1024
+
+
+def cached_filename(filename):
+    """Return the name of a binary rule file with the same rules as filename,
+    creating it in the cache if necessary.  If filename is already a binary
+    rule file, or the cache is disabled or unusable, returns filename."""
+    dir = cache_dir()
+    if not dir:
+        return filename
+    with open(filename, 'rb') as f:
+        if f.read(len(rulefile.MAGIC)) == rulefile.MAGIC:
+            return filename
+        f.seek(0)
+        digest = hashlib.sha1(VERSION)
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            digest.update(chunk)
+    entry = os.path.join(dir, digest.hexdigest() + '.rules')
+
+    if os.path.exists(entry):
+        # mark the entry as recently used, for eviction
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass  # evicted by another process; rebuild it below
+        else:
+            log.info("loading %s from cache entry %s", filename, entry)
+            return entry
+
+    try:
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        fd, tmp = tempfile.mkstemp(dir=dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            rulefile.write_rules(rulefile.load_rules(filename), tmp, 'binary')
+            os.rename(tmp, entry)
+        except:
+            os.unlink(tmp)
+            raise
+        log.info("cached %s as %s", filename, entry)
+        evict(dir, max_size())
+    except (IOError, OSError) as e:
+        log.warning("could not cache %s: %s", filename, e)
+        return filename
+    # the entry may have been evicted immediately, if it is too large
+    return entry if os.path.exists(entry) else filename
+
+
+def evict(dir, max_size):
+    """Delete the least-recently-used entries in the cache directory until
+    their total size is at most max_size bytes."""
+    entries = []
+    for name in os.listdir(dir):
+        if not name.endswith('.rules'):
+            continue
+        path = os.path.join(dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # evicted by another process
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        log.info("evicting cache entry %s", path)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total -= size
@@ -3,13 +3,13 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import itertools
-import json
 import os.path
 import logging
 
 from blessings import Terminal
-from fwunit import types
-from fwunit.ip import IP, IPSet, IPPairs
+from fwunit import rulefile
+from fwunit.analysis import cache
+from fwunit.ip import IP, IPSet, IPPairs, IPSetIndex
 
 log = logging.getLogger(__name__)
 terminal = Terminal()
@@ -22,8 +22,25 @@ def _ipset(ip):
     return ip
 
 class Source(object):
-    def __init__(self, filename):
-        self.rules = types.from_jsonable(json.load(open(filename))['rules'])
+
+    _rules = None
+    _indexes = None
+
+    def __init__(self, filename, lazy=True):
+        # by default, each app's rules are only decoded when first used
+        self.rules = rulefile.load_rules(filename, lazy=lazy)
+
+    @property
+    def rules(self):
+        """The rules for each app.  The rule lists must not be modified in
+        place after the first query; assign a new value instead, which
+        discards the indexes built from the old rules."""
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        self._rules = rules
+        self._indexes = None
 
     def rulesForApp(self, app):
         try:
@@ -31,6 +48,34 @@ class Source(object):
         except KeyError:
             return self.rules.get('@@other', [])
 
+    def _ruleIndex(self, app):
+        """Return (rules, src index, dst index) for the given app, or for all
+        apps if app is None.  The interval indexes are built on first use, and
+        unknown apps share the '@@other' index."""
+        if app is not None and app not in self.rules:
+            app = '@@other'
+        if self._indexes is None:
+            self._indexes = {}
+        if app not in self._indexes:
+            if app is None:
+                rules = list(itertools.chain(*self.rules.itervalues()))
+            else:
+                rules = self.rules.get(app, [])
+            self._indexes[app] = (rules,
+                                  IPSetIndex([r.src for r in rules]),
+                                  IPSetIndex([r.dst for r in rules]))
+        return self._indexes[app]
+
+    def _candidateRules(self, app, src=None, dst=None):
+        """Return the rules for the given app (or all apps, if app is None)
+        with a source overlapping src and a destination overlapping dst, in
+        their original order.  If src is None, any source matches."""
+        rules, src_index, dst_index = self._ruleIndex(app)
+        matches = set(dst_index.overlapping(dst))
+        if src is not None:
+            matches.intersection_update(src_index.overlapping(src))
+        return [rules[i] for i in sorted(matches)]
+
     def rulesDeny(self, src, dst, apps):
         src = _ipset(src)
         dst = _ipset(dst)
@@ -39,13 +84,9 @@ class Source(object):
         apps = apps if not isinstance(apps, basestring) else [apps]
         for app in apps:
             log.info("checking application %r" % app)
-            for rule in self.rulesForApp(app):
+            for rule in self._candidateRules(app, src, dst):
                 src_matches = (rule.src & src)
-                if not src_matches:
-                    continue
                 dst_matches = (rule.dst & dst)
-                if not dst_matches:
-                    continue
                 log.error("policy {t.cyan}{name}{t.normal} permits {t.bold_cyan}{app}{t.normal} "
                         "traffic\n{t.yellow}{src}{t.normal} -> {t.magenta}{dst}{t.normal}".format(
                     t=terminal,
@@ -65,12 +106,11 @@ class Source(object):
         apps = apps if not isinstance(apps, basestring) else [apps]
         for app in apps:
             log.info("checking application %r" % app)
-            for rule in self.rulesForApp(app):
-                if (rule.src & src) and (rule.dst & dst):
-                    log.info("matched policy {t.cyan}{name}{t.normal}\n{t.yellow}{src}{t.normal} "
-                            "-> {t.magenta}{dst}{t.normal}".format(
-                        t=terminal, name=rule.name, src=rule.src, dst=rule.dst))
-                    remaining = remaining - IPPairs((rule.src, rule.dst))
+            for rule in self._candidateRules(app, src, dst):
+                log.info("matched policy {t.cyan}{name}{t.normal}\n{t.yellow}{src}{t.normal} "
+                        "-> {t.magenta}{dst}{t.normal}".format(
+                    t=terminal, name=rule.name, src=rule.src, dst=rule.dst))
+                remaining = remaining - IPPairs((rule.src, rule.dst))
         if remaining:
             flows = ",\n".join("{t.yellow}{src}{t.normal} -> {t.magenta}{dst}{t.normal}".format(
                                 t=terminal, src=p[0], dst=p[1]) for p in remaining)
@@ -84,15 +124,11 @@ class Source(object):
         dst = _ipset(dst)
         log.info("allApps(%s, %s)" % (src, dst))
         rv = set()
-        for rule in itertools.chain(*self.rules.itervalues()):
+        for rule in self._candidateRules(None, src, dst):
             if not debug and rule.app in rv:
                 continue
             src_matches = (rule.src & src)
-            if not src_matches:
-                continue
             dst_matches = (rule.dst & dst)
-            if not dst_matches:
-                continue
             log.info("matched policy {t.cyan}{name}{t.normal} app {t.bold_cyan}{app}{t.normal}\n"
                      "{t.yellow}{src}{t.normal} -> {t.magenta}{dst}{t.normal}".format(
                         t=terminal, name=rule.name, src=src_matches, dst=dst_matches, app=rule.app))
@@ -105,16 +141,15 @@ class Source(object):
         dst = _ipset(dst)
         log.info("sourcesFor(%s, %r, ignore_sources=%s)" % (dst, app, ignore_sources))
         rv = IPSet()
-        for rule in self.rulesForApp(app):
-            if rule.dst & dst:
-                src = rule.src
-                if ignore_sources:
-                    src = src - ignore_sources
-                if src:
-                    log.info("matched policy {t.cyan}{name}{t.normal}\n{t.yellow}{src}{t.normal} "
-                             "-> {t.magenta}{dst}{t.normal}".format(
-                                t=terminal, name=rule.name, src=src, dst=rule.dst & dst))
-                    rv = rv + src
+        for rule in self._candidateRules(app, dst=dst):
+            src = rule.src
+            if ignore_sources:
+                src = src - ignore_sources
+            if src:
+                log.info("matched policy {t.cyan}{name}{t.normal}\n{t.yellow}{src}{t.normal} "
+                         "-> {t.magenta}{dst}{t.normal}".format(
+                            t=terminal, name=rule.name, src=src, dst=rule.dst & dst))
+                rv = rv + src
         return rv
 
 _cache = {}
@@ -123,7 +158,8 @@ _cache = {}
 def load_source(cfg, source):
     """Load the named source.  Sources are cached, so multiple calls with the same name
     will not repeatedly re-load the data from disk.  The source can name a source from
-    the configuration, or a filename."""
+    the configuration, or a filename.  Decoded JSON rule files are also cached
+    on disk, across processes; see fwunit.analysis.cache."""
     if source not in _cache:
         if source in cfg:
             filename = cfg[source]['output']
@@ -131,7 +167,7 @@ def load_source(cfg, source):
             filename = source
         else:
             raise KeyError("unknown source {}".format(source))
-        _cache[source] = Source(filename)
+        _cache[source] = Source(cache.cached_filename(filename))
     return _cache[source]
 
 
@@ -5,56 +5,84 @@
 import boto.ec2
 import boto.vpc
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger(__name__)
 
 
 class AWS(object):
-    
-    def __init__(self, access_key=None, secret_key=None):
+    """Access to EC2 and VPC information across regions.  If concurrency is
+    greater than one, up to that many regions are queried at the same time,
+    each in its own thread."""
+
+    # the maximum number of group ids to include in a single
+    # DescribeSecurityGroups request
+    max_group_ids = 200
+
+    def __init__(self, access_key=None, secret_key=None, concurrency=1):
         self._ec2_connections = {}
         self._vpc_connections = {}
+        self._connections_lock = threading.Lock()
         self.access_key = access_key
         self.secret_key = secret_key
+        self.concurrency = concurrency
 
     def get_ec2_connection(self, region):
-        if region not in self._ec2_connections:
-            self._ec2_connections[region] = \
-                boto.ec2.connect_to_region(
-                    region,
-                    aws_access_key_id=self.access_key,
-                    aws_secret_access_key=self.secret_key)
-        return self._ec2_connections[region]
+        with self._connections_lock:
+            if region not in self._ec2_connections:
+                self._ec2_connections[region] = \
+                    boto.ec2.connect_to_region(
+                        region,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key)
+            return self._ec2_connections[region]
 
     def get_vpc_connection(self, region):
-        if region not in self._vpc_connections:
-            conn = self.get_ec2_connection(region)
-            self._vpc_connections[region] = \
-                boto.vpc.VPCConnection(
-                    region=conn.region,
-                    aws_access_key_id=self.access_key,
-                    aws_secret_access_key=self.secret_key)
-        return self._vpc_connections[region]
+        conn = self.get_ec2_connection(region)
+        with self._connections_lock:
+            if region not in self._vpc_connections:
+                self._vpc_connections[region] = \
+                    boto.vpc.VPCConnection(
+                        region=conn.region,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key)
+            return self._vpc_connections[region]
+
+    def _map_regions(self, fn, regions):
+        # call fn(region) for each region, returning a list of the results; a
+        # region's connections are only ever used by one thread at a time
+        regions = list(regions)
+        if self.concurrency <= 1 or len(regions) <= 1:
+            return map(fn, regions)
+        pool = ThreadPool(min(self.concurrency, len(regions)))
+        try:
+            return pool.map(fn, regions)
+        finally:
+            pool.close()
+            pool.join()
 
     def all_regions(self):
         regions = boto.ec2.regions()
         return [r.name for r in regions]
 
     def get_all_subnets(self, regions):
-        all_subnets = {}
-        for region in regions:
+        def fetch(region):
             logger.debug("fetching subnets in %s" % region)
-            conn = self.get_vpc_connection(region)
-            for subnet in conn.get_all_subnets():
+            return self.get_vpc_connection(region).get_all_subnets()
+        all_subnets = {}
+        for subnets in self._map_regions(fetch, regions):
+            for subnet in subnets:
                 all_subnets[subnet.id] = subnet
         return all_subnets
 
     def get_all_instances(self, regions):
-        all_instances = {}
-        for region in regions:
+        def fetch(region):
             logger.debug("fetching instances in %s" % region)
-            conn = self.get_ec2_connection(region)
-            for instance in conn.get_only_instances():
+            return self.get_ec2_connection(region).get_only_instances()
+        all_instances = {}
+        for instances in self._map_regions(fetch, regions):
+            for instance in instances:
                 all_instances[instance.id] = instance
         return all_instances
 
@@ -65,3 +93,30 @@ class AWS(object):
         if not sgs:
             return None
         return sgs[0]
+
+    def get_security_groups(self, sgids):
+        """Fetch the security groups for the given SecurityGroupIds, with one
+        request per region for each max_group_ids groups.  Returns a
+        dictionary keyed by SecurityGroupId; groups which do not exist are
+        omitted."""
+        sgids_by_region = {}
+        for sgid in sgids:
+            sgids_by_region.setdefault(sgid.region, {})[sgid.id] = sgid
+
+        def fetch(region):
+            by_id = sgids_by_region[region]
+            logger.debug("fetching %d security groups in %s",
+                         len(by_id), region)
+            conn = self.get_ec2_connection(region)
+            ids = sorted(by_id)
+            found = []
+            for i in xrange(0, len(ids), self.max_group_ids):
+                sgs = conn.get_all_security_groups(
+                    group_ids=ids[i:i + self.max_group_ids])
+                found.extend((by_id[sg.id], sg)
+                             for sg in sgs if sg.id in by_id)
+            return found
+        security_groups = {}
+        for sgs in self._map_regions(fetch, sgids_by_region):
+            security_groups.update(sgs)
+        return security_groups
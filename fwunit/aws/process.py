@@ -3,8 +3,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import bisect
+import heapq
 import itertools
-from fwunit.ip import IP, IPSet
+from fwunit.ip import IP, IPSet, IPSetIndex
 import logging
 from fwunit.types import Rule
 from fwunit.common import simplify_rules
@@ -16,6 +17,15 @@ logger = logging.getLogger(__name__)
 Subnet = namedtuple('Subnet', ['cidr_block', 'name', 'dynamic'])
 SecurityGroupId = namedtuple('SecurityGroupId', ['id', 'region'])
 
+# symbolic apps for rules which apply to all apps, and to all apps except
+# '@@other', respectively
+ANY_APP = '@@any'
+KNOWN_APPS = '@@known'
+
+
+def _union(ipsets):
+    return IPSet.from_ranges(itertools.chain(*[s.ranges for s in ipsets]))
+
 
 def get_rules(aws, app_map, regions, dynamic_subnets):
     if not regions:
@@ -97,9 +107,9 @@ def get_rules(aws, app_map, regions, dynamic_subnets):
 
     logger.info("accumulating security groups")
     all_apps = set(app_map.values())
-    security_groups = {}
+    security_groups = aws.get_security_groups(all_sgids)
     for sgid in all_sgids:
-        sg = security_groups[sgid] = aws.get_security_group(sgid)
+        sg = security_groups.get(sgid)
         assert sg, "no security group with id {}".format(sgid)
         # pre-process all of the rules' apps now
         for sgrule in itertools.chain(sg.rules, sg.rules_egress):
@@ -117,88 +127,124 @@ def get_rules(aws, app_map, regions, dynamic_subnets):
             sgrule.app = app
             all_apps.add(app)
 
-    rules = {}
-    to_intersect = {}
+    # Security group rules for '*/any' apply to every app, including
+    # '@@other', and the 'unoccupied/out' rules apply to every known app.
+    # Rather than copying those rules for each app, they are kept under the
+    # symbolic apps ANY_APP and KNOWN_APPS, and only materialized for each app
+    # when writing the output.  Each rule is numbered as it is made, so that
+    # merging the symbolic rules with an app's own rules preserves their order.
+    seq = itertools.count()
+    rules = {}  # {app: [(seq, src, dst, name)]}
+    to_intersect = {}  # {app: {dir: [(seq, src, dst, name)]}}
     def make_rules(sgid, local):
         sg = security_groups[sgid]
         for dir, sgrules in [('in', sg.rules), ('out', sg.rules_egress)]:
             for sgrule in sgrules:
-                if sgrule.app == '*/any':
-                    apps = all_apps | set(['@@other'])
-                else:
-                    apps = [sgrule.app]
-                for app in apps:
-                    for grant in sgrule.grants:
-                        if grant.cidr_ip:
-                            remote = IPSet([IP(grant.cidr_ip)])
-                        else:
-                            remote = ips_by_sg.get(grant.group_id, None)
-                            if not remote:
-                                continue
-                        src, dst = (remote, local) if dir == 'in' else (local, remote)
-                        name = "{}/{}".format(sg.name, dir)
-                        # first make rules involving non-managed space, leaving
-                        # only managed-to-managed
-                        if dir == 'in':
-                            unmanaged_src = src & unmanaged_ip_space
-                            if unmanaged_src:
-                                rules.setdefault(app, []).append(Rule(
-                                    src=unmanaged_src, dst=dst, app=app, name=name))
-                            src = src & managed_ip_space
-                        else:
-                            unmanaged_dst = dst & unmanaged_ip_space
-                            if unmanaged_dst:
-                                rules.setdefault(app, []).append(Rule(
-                                    src=src, dst=unmanaged_dst, app=app, name=name))
-                            dst = dst & managed_ip_space
-                        if src and dst:
-                            to_intersect.setdefault(app, {}).setdefault(dir, []).append((src, dst, name))
-
-    logger.info("writing rules for dynamic subnets")
+                app = ANY_APP if sgrule.app == '*/any' else sgrule.app
+                for grant in sgrule.grants:
+                    if grant.cidr_ip:
+                        remote = IPSet([IP(grant.cidr_ip)])
+                    else:
+                        remote = ips_by_sg.get(grant.group_id, None)
+                        if not remote:
+                            continue
+                    src, dst = (remote, local) if dir == 'in' else (local, remote)
+                    name = "{}/{}".format(sg.name, dir)
+                    # first make rules involving non-managed space, leaving
+                    # only managed-to-managed
+                    if dir == 'in':
+                        unmanaged_src = src & unmanaged_ip_space
+                        if unmanaged_src:
+                            rules.setdefault(app, []).append(
+                                (next(seq), unmanaged_src, dst, name))
+                        src = src & managed_ip_space
+                    else:
+                        unmanaged_dst = dst & unmanaged_ip_space
+                        if unmanaged_dst:
+                            rules.setdefault(app, []).append(
+                                (next(seq), src, unmanaged_dst, name))
+                        dst = dst & managed_ip_space
+                    if src and dst:
+                        to_intersect.setdefault(app, {}).setdefault(dir, []).append(
+                            (next(seq), src, dst, name))
+
+    # every member of a security group gets the same rules, so gather the IPs
+    # each security group applies to, and make its rules once for all of them
+    logger.info("collecting security group members in dynamic subnets")
+    locals_by_sgid = {}
     for subnet_name, sgids in sgids_by_dynamic_subnet.iteritems():
         subnet = dynamic_ipsets[subnet_name]
         logger.debug(" subnet %s, %s", subnet_name, subnet)
         for sgid in sgids:
-            make_rules(sgid, subnet)
+            locals_by_sgid.setdefault(sgid, []).append(subnet)
 
-    logger.info("writing rules for instances in per-host subnets")
-    per_host_host_ips = IPSet()
+    logger.info("collecting security group members in per-host subnets")
+    host_ips = []
     for inst_name, info in sgids_by_instance.iteritems():
         ip, sgids = info
         logger.debug(" instance %s at %s", inst_name, ip)
         host_ip = IPSet([ip])
-        per_host_host_ips += host_ip
+        host_ips.append(host_ip)
         for sgid in sgids:
-            make_rules(sgid, host_ip)
+            locals_by_sgid.setdefault(sgid, []).append(host_ip)
+    per_host_host_ips = _union(host_ips)
+
+    logger.info("writing rules for %d security groups", len(locals_by_sgid))
+    for sgid in sorted(locals_by_sgid):
+        make_rules(sgid, _union(locals_by_sgid[sgid]))
 
     logger.info("assuming unrestricted outbound access from unoccupied IPs in per-host subnets")
     unoccupied = per_host_subnet_ips - per_host_host_ips
-    for app in all_apps:
-        rules.setdefault(app, []).append(Rule(
-            src=unoccupied, dst=unmanaged_ip_space, app=app, name='unoccupied/out'))
-        to_intersect.setdefault(app, {}).setdefault('out', []).append((unoccupied, managed_ip_space, 'unoccupied/out'))
-
-    # traffic within the manage Ip space is governed both by outbound rules on
-    # the source and inbound rules on the destination.
-    logger.info("intersecting inbound and outbound rules")
-    for app, dirs in to_intersect.iteritems():
-        in_rules = dirs.get('in', [])
-        out_rules = dirs.get('out', [])
+    rules[KNOWN_APPS] = [
+        (next(seq), unoccupied, unmanaged_ip_space, 'unoccupied/out')]
+    to_intersect[KNOWN_APPS] = {'out': [
+        (next(seq), unoccupied, managed_ip_space, 'unoccupied/out')]}
+
+    def app_rules(app, symbolic_apps):
+        # materialize the rules for app, given the symbolic apps whose rules
+        # also apply to it
+        keys = (app,) + symbolic_apps
+        app_rules = [Rule(src=src, dst=dst, app=app, name=name) for _, src, dst, name
+                     in heapq.merge(*[rules.get(k, []) for k in keys])]
+
+        # traffic within the manage Ip space is governed both by outbound rules on
+        # the source and inbound rules on the destination.
         logger.debug("..for %s", app)
+        dirs = [to_intersect.get(k, {}) for k in keys]
+        in_rules = list(heapq.merge(*[d.get('in', []) for d in dirs]))
+        out_rules = list(heapq.merge(*[d.get('out', []) for d in dirs]))
         new_rules = []
+        # index the outbound rules' sources, so each inbound rule is only
+        # intersected with the outbound rules it overlaps in both source and
+        # destination
+        index = IPSetIndex([outr[1] for outr in out_rules])
         for inr in in_rules:
-            for outr in out_rules:
-                src = inr[0] & outr[0]
-                if not src:
-                    continue
-                dst = inr[1] & outr[1]
-                if not dst:
-                    continue
-                new_rules.append(Rule(src=src, dst=dst, app=app,
-                                      name=combine_names(inr[2], outr[2])))
+            for o in index.overlapping(inr[1]):
+                outr = out_rules[o]
+                dst = inr[2] & outr[2]
+                if dst:
+                    new_rules.append(Rule(
+                        src=inr[1] & outr[1], dst=dst, app=app,
+                        name=combine_names(inr[3], outr[3])))
         # simplify now, within this app, to save space and time
         new_rules = simplify_rules({app: new_rules})[app]
-        rules.setdefault(app, []).extend(new_rules)
+        return simplify_rules({app: app_rules + new_rules})[app]
 
-    rules = simplify_rules(rules)
-    return rules
+    logger.info("intersecting inbound and outbound rules")
+    output_apps = set(all_apps)
+    if ANY_APP in rules or ANY_APP in to_intersect:
+        output_apps.add('@@other')
+    # apps with no rules of their own all get the same rules, so calculate
+    # those only once
+    known_only = None
+    result = {}
+    for app in output_apps:
+        symbolic_apps = (ANY_APP, KNOWN_APPS) if app in all_apps else (ANY_APP,)
+        if app in all_apps and app not in rules and app not in to_intersect:
+            if known_only is None:
+                known_only = app_rules(KNOWN_APPS, (ANY_APP,))
+            result[app] = [Rule(src=r.src, dst=r.dst, app=app, name=r.name)
+                           for r in known_only]
+        else:
+            result[app] = app_rules(app, symbolic_apps)
+    return result
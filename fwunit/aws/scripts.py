@@ -4,6 +4,7 @@
 
 from . import process
 from . import aws
+from . import snapshot
 from fwunit import common
 
 
@@ -11,9 +12,18 @@ def run(cfg, fwunit_cfg):
     app_map = common.ApplicationMap(cfg)
     regions = cfg.get('regions', None)
     dynamic_subnets = cfg.get('dynamic_subnets', [])
-    if 'credentials' in cfg:
+    concurrency = cfg.get('concurrency', 1)
+    if 'load_snapshot' in cfg:
+        aws_conn = snapshot.Snapshot.load(cfg['load_snapshot'])
+    elif 'credentials' in cfg:
         aws_conn = aws.AWS(cfg['credentials']['access_key'],
-                           cfg['credentials']['secret_key'])
+                           cfg['credentials']['secret_key'],
+                           concurrency=concurrency)
     else:
-        aws_conn = aws.AWS()
-    return process.get_rules(aws_conn, app_map, regions, dynamic_subnets)
+        aws_conn = aws.AWS(concurrency=concurrency)
+    if 'save_snapshot' in cfg:
+        aws_conn = snapshot.Recorder(aws_conn)
+    rules = process.get_rules(aws_conn, app_map, regions, dynamic_subnets)
+    if 'save_snapshot' in cfg:
+        aws_conn.snapshot.save(cfg['save_snapshot'])
+    return rules
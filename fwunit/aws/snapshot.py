@@ -0,0 +1,155 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Snapshots of the AWS inventory (subnets, instances, and security groups),
+# so that rules can be re-processed without querying AWS.  A Recorder wraps an
+# AWS object and records everything fetched through it; a Snapshot has the
+# same interface as AWS, and replays that data.
+
+import cPickle
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# bump this when the format of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+
+class _Object(object):
+    # a stand-in for the boto object of the same shape
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _sgrules(sgrules):
+    return [(r.ip_protocol, r.from_port, r.to_port,
+             [(g.cidr_ip, g.group_id) for g in r.grants])
+            for r in sgrules]
+
+
+def _sgrule_objects(sgrules):
+    return [_Object(ip_protocol=proto, from_port=from_port, to_port=to_port,
+                    grants=[_Object(cidr_ip=cidr_ip, group_id=group_id)
+                            for cidr_ip, group_id in grants])
+            for proto, from_port, to_port, grants in sgrules]
+
+
+class Snapshot(object):
+    """The AWS inventory for a set of regions, stored as plain tuples.  This
+    has the same interface as fwunit.aws.aws.AWS, returning objects with the
+    attributes used by get_rules."""
+
+    def __init__(self):
+        self.regions = set()
+        self.subnets = {}  # id: (region, cidr_block, tags)
+        # id: (region, state, vpc_id, private_ip_address, group ids, tags)
+        self.instances = {}
+        # (region, id): (name, rules, egress rules)
+        self.security_groups = {}
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            version, data = cPickle.load(f)
+        if version != SNAPSHOT_VERSION:
+            raise RuntimeError("{} has unsupported snapshot version {}".format(
+                filename, version))
+        snapshot = cls()
+        (snapshot.regions, snapshot.subnets, snapshot.instances,
+         snapshot.security_groups) = data
+        return snapshot
+
+    def save(self, filename):
+        data = (self.regions, self.subnets, self.instances, self.security_groups)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((SNAPSHOT_VERSION, data), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, filename)
+
+    def _check_regions(self, regions):
+        missing = set(regions) - self.regions
+        if missing:
+            raise RuntimeError("regions {} are not in the snapshot".format(
+                ', '.join(sorted(missing))))
+        return set(regions)
+
+    def all_regions(self):
+        return sorted(self.regions)
+
+    def get_all_subnets(self, regions):
+        regions = self._check_regions(regions)
+        return {id: _Object(id=id, cidr_block=cidr_block, tags=dict(tags))
+                for id, (region, cidr_block, tags) in self.subnets.iteritems()
+                if region in regions}
+
+    def get_all_instances(self, regions):
+        regions = self._check_regions(regions)
+        all_instances = {}
+        for id, info in self.instances.iteritems():
+            region, state, vpc_id, private_ip_address, group_ids, tags = info
+            if region not in regions:
+                continue
+            all_instances[id] = _Object(
+                id=id, region=_Object(name=region), state=state, vpc_id=vpc_id,
+                private_ip_address=private_ip_address,
+                groups=[_Object(id=g) for g in group_ids], tags=dict(tags))
+        return all_instances
+
+    def get_security_groups(self, sgids):
+        security_groups = {}
+        for sgid in sgids:
+            try:
+                name, rules, rules_egress = \
+                    self.security_groups[sgid.region, sgid.id]
+            except KeyError:
+                continue
+            security_groups[sgid] = _Object(
+                id=sgid.id, name=name, rules=_sgrule_objects(rules),
+                rules_egress=_sgrule_objects(rules_egress))
+        return security_groups
+
+    def get_security_group(self, sgid):
+        return self.get_security_groups([sgid]).get(sgid)
+
+
+class Recorder(object):
+    """Wraps an AWS object, recording everything fetched through it in
+    self.snapshot."""
+
+    def __init__(self, aws):
+        self.aws = aws
+        self.snapshot = Snapshot()
+
+    def all_regions(self):
+        return self.aws.all_regions()
+
+    def get_all_subnets(self, regions):
+        all_subnets = self.aws.get_all_subnets(regions)
+        self.snapshot.regions.update(regions)
+        for id, subnet in all_subnets.iteritems():
+            self.snapshot.subnets[id] = (
+                subnet.region.name, subnet.cidr_block, dict(subnet.tags))
+        return all_subnets
+
+    def get_all_instances(self, regions):
+        all_instances = self.aws.get_all_instances(regions)
+        self.snapshot.regions.update(regions)
+        for id, instance in all_instances.iteritems():
+            self.snapshot.instances[id] = (
+                instance.region.name, instance.state, instance.vpc_id,
+                instance.private_ip_address, [g.id for g in instance.groups],
+                dict(instance.tags))
+        return all_instances
+
+    def get_security_groups(self, sgids):
+        security_groups = self.aws.get_security_groups(sgids)
+        for sgid, sg in security_groups.iteritems():
+            self.snapshot.security_groups[sgid.region, sgid.id] = (
+                sg.name, _sgrules(sg.rules), _sgrules(sg.rules_egress))
+        return security_groups
+
+    def get_security_group(self, sgid):
+        return self.get_security_groups([sgid]).get(sgid)
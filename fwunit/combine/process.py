@@ -3,86 +3,165 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging
+import multiprocessing
+from fwunit.ip import IPSet
+from fwunit.ip import IPSetIndex
+from fwunit.ip import overlapping_pairs
 from fwunit.types import Rule
 from fwunit.common import simplify_rules
 from fwunit.common import combine_names
 
 logger = logging.getLogger(__name__)
 
-def combine(address_spaces, routes, sources):
+def combine(address_spaces, routes, sources, workers=1):
     # get the set of all apps
     all_apps = set()
     for rules in sources.itervalues():
         all_apps = all_apps | set(rules)
 
-    # for each address space, add any apps which aren't explicitly specified in that
-    # address space, but *are* specified in the combined ruleset, as copies of that
-    # address space's '@@other' app.  This ensures that each space has the same set
-    # of apps.
-    for rules in sources.itervalues():
-        other = rules.get('@@other', [])
-        missing_apps = all_apps - set(rules)
-        for app in missing_apps:
-            rules[app] = [Rule(src=r.src, dst=r.dst, app=app, name=r.name)
-                          for r in other]
-
-    combined_rules = {}
-    for app in all_apps:
-        logger.info("combining app %s", app)
-        # The idea here is this: for each pair of address spaces, look at the
-        # set of rules specified in the routes.  Only write combined rules for
-        # flows for which are allowed by all rulesets.
-        for local_sp_name, local_sp in address_spaces.iteritems():
-            for remote_sp_name, remote_sp in address_spaces.iteritems():
-                source_names = routes[local_sp_name, remote_sp_name]
-                if not source_names:
+    # any apps which aren't explicitly specified in a source, but *are*
+    # specified in the combined ruleset, are governed by that source's
+    # '@@other' rules.  This ensures that each source has the same set of apps.
+    # Those rules are used in place (see source_rules) rather than copied for
+    # each app, and the sources are not modified.  Remember which apps take
+    # their rules from '@@other' in each source.
+    synthesized = {}
+    for name, rules in sources.iteritems():
+        synthesized[name] = all_apps - set(rules)
+
+    # split each source's rules by the address spaces they apply to, once, so
+    # that each pair of address spaces only handles the rules touching it
+    logger.info("partitioning rules by address space")
+    partitioned = {name: partition_rules(rules, address_spaces)
+                   for name, rules in sources.iteritems()}
+
+    # Apps are independent of one another, so they can be combined in parallel
+    apps = sorted(all_apps)
+    # Apps which are copies of '@@other' in every source for a pair of address
+    # spaces all combine to the same rules, so those are only calculated once
+    # per pair of address spaces (in each process), keyed by (local, remote).
+    args = (address_spaces, routes, partitioned, synthesized, {})
+    if workers > 1 and len(apps) > 1:
+        logger.info("using %d worker processes", workers)
+        pool = multiprocessing.Pool(workers, _init_worker, args)
+        try:
+            # imap returns results in order, so the merge is deterministic
+            combined = [_decode_rules(app, encoded) for app, encoded in
+                        zip(apps, pool.imap(_combine_app_worker, apps))]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        combined = [combine_app(app, *args) for app in apps]
+
+    return {app: rules for app, rules in zip(apps, combined) if rules}
+
+def combine_app(app, address_spaces, routes, partitioned, synthesized,
+                other_results):
+    """Combine the rules for a single app, given the sources' rules as
+    partitioned by partition_rules, returning a simplified list of rules"""
+    logger.info("combining app %s", app)
+    combined_rules = []
+    # The idea here is this: for each pair of address spaces, look at the
+    # set of rules specified in the routes.  Only write combined rules for
+    # flows for which are allowed by all rulesets.
+    for local_sp_name in address_spaces:
+        for remote_sp_name in address_spaces:
+            source_names = routes[local_sp_name, remote_sp_name]
+            if not source_names:
+                continue
+            logger.debug(" from %s to %s using %s",
+                    local_sp_name, remote_sp_name, ', '.join(source_names))
+            key = local_sp_name, remote_sp_name
+            rulesets = [source_rules(partitioned[n], app).get(key, [])
+                        for n in source_names]
+            if all(app in synthesized[n] for n in source_names):
+                if key not in other_results:
+                    other_results[key] = combine_partitioned(rulesets)
+                new_rules = other_results[key]
+            else:
+                new_rules = combine_partitioned(rulesets)
+            # rules from '@@other' are still labeled with that app
+            new_rules = [r if r.app == app else
+                         Rule(src=r.src, dst=r.dst, app=app, name=r.name)
+                         for r in new_rules]
+            combined_rules.extend(new_rules)
+
+    if not combined_rules:
+        return []
+    return simplify_rules({app: combined_rules})[app]
+
+def source_rules(rules, app):
+    """Get the rules for app from a source's rules, falling back to the
+    source's '@@other' rules for apps it does not specify"""
+    if app in rules:
+        return rules[app]
+    return rules.get('@@other', [])
+
+def partition_rules(rules, address_spaces):
+    """Split a source's rules, {app: [rules]}, into {app: {(local, remote):
+    [rules]}}, where each rule is limited to the local address space for its
+    source and the remote address space for its destination.  Rules appear in
+    the same order within each partition."""
+    names = list(address_spaces)
+    index = IPSetIndex([address_spaces[n] for n in names])
+    partitioned = {}
+    for app, app_rules in rules.iteritems():
+        by_pair = partitioned[app] = {}
+        for r in app_rules:
+            dsts = []
+            for d in index.overlapping(r.dst):
+                dst = r.dst & address_spaces[names[d]]
+                if dst:
+                    dsts.append((names[d], dst))
+            if not dsts:
+                continue
+            for s in index.overlapping(r.src):
+                src = r.src & address_spaces[names[s]]
+                if not src:
                     continue
-                logger.debug(" from %s to %s using %s",
-                        local_sp_name, remote_sp_name, ', '.join(source_names))
-                rulesets = [sources[n][app] for n in source_names]
-
-                # if we only have one source, this is pretty easy:
-                # just limit each rule to the relevant IP spaces; otherwise
-                # we need to do a recursive intersection
-                if len(rulesets) == 1:
-                    new_rules = rules_from_to(rulesets[0], local_sp, remote_sp)
-                else:
-                    new_rules = intersect_rules(rulesets, local_sp, remote_sp)
-                if new_rules:
-                    combined_rules.setdefault(app, []).extend(new_rules)
-
-    rules = simplify_rules(combined_rules)
-    return rules
-
-def rules_from_to(rules, local_sp, remote_sp):
-    rv = []
-    for r in rules:
-        src = r.src & local_sp
-        if not src:
-            continue
-        dst = r.dst & remote_sp
-        if not dst:
-            continue
-        rv.append(Rule(src=src, dst=dst, app=r.app, name=r.name))
-    return rv
-
-def intersect_rules(rulesets, local_sp, remote_sp):
-    # combine the rulesets into an accumulator seeded with the first
+                for remote_sp_name, dst in dsts:
+                    by_pair.setdefault((names[s], remote_sp_name), []).append(
+                        Rule(src=src, dst=dst, app=r.app, name=r.name))
+    return partitioned
+
+# arguments to combine_app shared by all tasks in a worker process, set by
+# _init_worker
+_worker_args = None
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+def _combine_app_worker(app):
+    # rules are returned as flat range tuples rather than Rules, to keep the
+    # results small and quick to unpickle
+    return [(r.src._ranges, r.dst._ranges, r.name)
+            for r in combine_app(app, *_worker_args)]
+
+def _decode_rules(app, encoded):
+    return [Rule(src=IPSet._from_flat(src), dst=IPSet._from_flat(dst),
+                 app=app, name=name)
+            for src, dst, name in encoded]
+
+def combine_partitioned(rulesets):
+    """Combine rulesets already limited to a pair of address spaces by
+    partition_rules, returning the rules allowed by all of them"""
+    # if we only have one source, this is pretty easy; otherwise we need to
+    # do a recursive intersection, with an accumulator seeded with the last
     # ruleset
-    acc = rules_from_to(rulesets.pop(), local_sp, remote_sp)
-    while rulesets:
-        rs = rules_from_to(rulesets.pop(), local_sp, remote_sp)
+    if len(rulesets) == 1:
+        return rulesets[0]
+    rulesets = list(rulesets)
+    acc = rulesets.pop()
+    while rulesets and acc:
+        rs = rulesets.pop()
         intersected = []
-        for rl in acc:
-            for rr in rs:
-                src = rl.src & rr.src
-                if not src:
-                    continue
-                dst = rl.dst & rr.dst
-                if not dst:
-                    continue
-                intersected.append(Rule(
-                    src=src, dst=dst, app=rl.app,
-                    name=combine_names(rl.name, rr.name)))
+        for l, r in overlapping_pairs([rl[:2] for rl in acc],
+                                      [rr[:2] for rr in rs]):
+            rl, rr = acc[l], rs[r]
+            intersected.append(Rule(
+                src=rl.src & rr.src, dst=rl.dst & rr.dst, app=rl.app,
+                name=combine_names(rl.name, rr.name)))
         acc = intersected
     return acc
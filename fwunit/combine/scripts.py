@@ -3,16 +3,15 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
-import json
 
 from . import process
-from fwunit import types
+from fwunit import rulefile
 from fwunit.ip import IP, IPSet
 
 
 def get_rules(fwunit_cfg, source_name):
     input = fwunit_cfg[source_name]['output']
-    return types.from_jsonable(json.load(open(input))['rules'])
+    return rulefile.load_rules(input)
 
 def run(cfg, fwunit_cfg):
     address_spaces = {}
@@ -64,4 +63,5 @@ def run(cfg, fwunit_cfg):
     for rs in sources:
         sources[rs] = get_rules(fwunit_cfg, rs)
 
-    return process.combine(address_spaces, routes, sources)
+    return process.combine(address_spaces, routes, sources,
+                           workers=cfg.get('workers', 1))
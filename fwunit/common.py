@@ -2,7 +2,10 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 import logging
+import time
+from .ip import IPSet
 from .types import Rule
 
 logger = logging.getLogger(__name__)
@@ -21,39 +24,77 @@ def simplify_rules(rules):
     the same source, or exactly the same destination -- repeatedly, until
     nothing changes."""
     assert isinstance(rules, dict)
-    logger.info("simplifying %d rules", len(rules))
-    pass_num = 1
-    while True:
-        logger.debug(" pass %d", pass_num)
-        pass_num += 1
+    start = time.time()
+    logger.info("simplifying %d rules", sum(len(r) for r in rules.itervalues()))
+    max_passes = 0
+    for app, app_rules in rules.iteritems():
+        rules[app], passes = _simplify_app_rules(app, app_rules)
+        max_passes = max(max_passes, passes)
+    logger.debug(" result: %d rules after at most %d passes in %.2fs",
+                 sum(len(r) for r in rules.itervalues()), max_passes,
+                 time.time() - start)
+    return rules
+
+
+def _simplify_app_rules(app, app_rules):
+    # Each pass combines all rules with the same source, then all rules with
+    # the same destination.  Rules are indexed by their (interned) source and
+    # destination IPSets, so each step only needs to look at the groups
+    # containing a rule that was created since the last step on that side.
+    # Returns the simplified rules, sorted by destination, and the number of
+    # passes.
+    live = {}  # id -> rule
+    keys = {}  # id -> (src, dst)
+    index = ({}, {})  # by src, by dst: IPSet -> set of ids
+    changed = (set(), set())  # ids created since the last step by src, dst
+    next_id = itertools.count()
+
+    def add(rule):
+        id = next(next_id)
+        live[id] = rule
+        keys[id] = (rule.src, rule.dst)
+        for combine_by in 0, 1:
+            index[combine_by].setdefault(keys[id][combine_by], set()).add(id)
+            changed[combine_by].add(id)
+
+    def remove(id):
+        del live[id]
+        for combine_by, key in enumerate(keys.pop(id)):
+            index[combine_by][key].discard(id)
+            if not index[combine_by][key]:
+                del index[combine_by][key]
+            changed[combine_by].discard(id)
+
+    def union(ipsets):
+        return IPSet.from_ranges(itertools.chain(*[s.ranges for s in ipsets]))
+
+    for rule in app_rules:
+        add(rule)
+
+    passes = 0
+    while changed[0] or changed[1]:
+        passes += 1
         combined = 0
-        for app, app_rules in rules.iteritems():
-            for combine_by in 0, 1:  # src, dst
-                # sort by prefix, so that identical IPSets sort together
-                app_rules.sort(key=lambda r: (r[combine_by].prefixes, r.name))
-                rv = []
-                last = None
-                for rule in app_rules:
-                    if last and last[combine_by] == rule[combine_by]:
-                        rule = Rule(last.src + rule.src,
-                                    last.dst + rule.dst,
-                                    app,
-                                    combine_names(last.name, rule.name))
-                        rv[-1] = rule
-                        combined += 1
-                    else:
-                        rv.append(rule)
-                    last = rule
-                app_rules = rv
-            rules[app] = app_rules
-
-        # if nothing was combined on this iteration, we're done
+        for combine_by in 0, 1:  # src, dst
+            changed_keys = set(keys[id][combine_by] for id in changed[combine_by])
+            changed[combine_by].clear()
+            for key in changed_keys:
+                group = index[combine_by].get(key, ())
+                if len(group) < 2:
+                    continue
+                group = sorted((live[id] for id in group), key=lambda r: r.name)
+                for id in list(index[combine_by][key]):
+                    remove(id)
+                add(Rule(union(r.src for r in group),
+                         union(r.dst for r in group),
+                         app,
+                         reduce(combine_names, (r.name for r in group))))
+                combined += len(group) - 1
+        logger.debug(" %s pass %d: eliminated %d rules", app, passes, combined)
         if not combined:
             break
-        logger.debug("  eliminated %d rules", combined)
 
-    logger.debug(" result: %d rules", sum([0] + [len(rlist) for rlist in rules.itervalues()]))
-    return rules
+    return sorted(live.itervalues(), key=lambda r: (r.dst, r.name)), passes
 
 
 class ApplicationMap(object):
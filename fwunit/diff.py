@@ -2,7 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
 from fwunit.ip import IPPairs
+from fwunit.ip import IPSet
 from fwunit.analysis import sources
 from blessings import Terminal
 
@@ -10,10 +12,20 @@ terminal = Terminal()
 
 
 def app_diff(app, left, right):
-    left_pairs = IPPairs(*[(r.src, r.dst) for r in left])
-    right_pairs = IPPairs(*[(r.src, r.dst) for r in right])
-    added = right_pairs - left_pairs
-    removed = left_pairs - right_pairs
+    left_pairs = set((r.src, r.dst) for r in left)
+    right_pairs = set((r.src, r.dst) for r in right)
+    # rules identical on both sides cancel out.  They still cover the flows of
+    # the remaining rules, but only where their sources overlap.
+    common = left_pairs & right_pairs
+    left_pairs -= common
+    right_pairs -= common
+    if not left_pairs and not right_pairs:
+        return
+    changed_srcs = IPSet.from_ranges(itertools.chain(
+        *[src.ranges for src, _ in left_pairs | right_pairs]))
+    common = [(src, dst) for src, dst in common if src & changed_srcs]
+    removed, added = IPPairs(*(list(left_pairs) + common)).differences(
+        IPPairs(*(list(right_pairs) + common)))
     for s, d in removed:
         yield ("-", app, s, d)
     for s, d in added:
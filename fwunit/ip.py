@@ -4,146 +4,681 @@
 
 import IPy
 import bisect
+import itertools
+import weakref
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 # IPy's IP seems sufficient
 IP = IPy.IP
 
+_IPV4_END = 1 << 32
+
+
+def _ip_range(ip):
+    """Return the [start, end) integer range covered by an IP, or None if it
+    is not an IPv4 address.  fwunit only handles IPv4, so IPSets ignore other
+    addresses."""
+    if not isinstance(ip, IP):
+        ip = IP(ip)
+    if ip.version() != 4:
+        return None
+    start = ip.int()
+    return start, start + ip.len()
+
+
+def _normalize(ranges):
+    """Sort and merge a sequence of (start, end) pairs, returning a flat tuple
+    of non-overlapping, non-adjacent ranges"""
+    flat = []
+    for start, end in sorted(ranges):
+        if start >= end:
+            continue
+        if flat and start <= flat[-1]:
+            if end > flat[-1]:
+                flat[-1] = end
+        else:
+            flat.append(start)
+            flat.append(end)
+    return tuple(flat)
+
+
+def _union(a, b):
+    if not a:
+        return b
+    if not b:
+        return a
+    # merge the two (already sorted) lists of starts, then coalesce
+    flat = []
+    i = j = 0
+    la, lb = len(a), len(b)
+    while i < la or j < lb:
+        if j >= lb or (i < la and a[i] <= b[j]):
+            start, end = a[i], a[i + 1]
+            i += 2
+        else:
+            start, end = b[j], b[j + 1]
+            j += 2
+        if flat and start <= flat[-1]:
+            if end > flat[-1]:
+                flat[-1] = end
+        else:
+            flat.append(start)
+            flat.append(end)
+    return tuple(flat)
+
+
+def _intersection(a, b):
+    flat = []
+    i = j = 0
+    la, lb = len(a), len(b)
+    while i < la and j < lb:
+        a_end, b_end = a[i + 1], b[j + 1]
+        start = a[i] if a[i] > b[j] else b[j]
+        end = a_end if a_end < b_end else b_end
+        if start < end:
+            flat.append(start)
+            flat.append(end)
+        if a_end < b_end:
+            i += 2
+        else:
+            j += 2
+    return tuple(flat)
+
+
+def _difference(a, b):
+    if not a or not b:
+        return a
+    flat = []
+    j = 0
+    lb = len(b)
+    for i in xrange(0, len(a), 2):
+        start, end = a[i], a[i + 1]
+        # skip subtrahend ranges entirely before this range
+        while j < lb and b[j + 1] <= start:
+            j += 2
+        k = j
+        while k < lb and b[k] < end:
+            if b[k] > start:
+                flat.append(start)
+                flat.append(b[k])
+            start = b[k + 1]
+            if start >= end:
+                break
+            k += 2
+        if start < end:
+            flat.append(start)
+            flat.append(end)
+    return tuple(flat)
+
+
+def _isdisjoint(a, b):
+    i = j = 0
+    la, lb = len(a), len(b)
+    while i < la and j < lb:
+        if a[i] < b[j + 1] and b[j] < a[i + 1]:
+            return False
+        if a[i + 1] < b[j + 1]:
+            i += 2
+        else:
+            j += 2
+    return True
+
+
+def _range_prefixes(start, end):
+    """Generate the minimal list of CIDR prefixes covering [start, end)"""
+    while start < end:
+        # the largest block aligned at start..
+        size = (start & -start) or _IPV4_END
+        # ..that does not extend past end
+        while size > end - start:
+            size >>= 1
+        ip = IP(start, ipversion=4)
+        ip._prefixlen = 33 - size.bit_length()
+        yield ip
+        start += size
+
+
+# all live IPSets, keyed by their ranges; see IPSet._from_flat
+_interned = weakref.WeakValueDictionary()
+
 
 class IPSet(IPy.IPSet):
-    # IPy's IPSet needs some help
+    """A set of IPv4 addresses, stored as a sorted tuple of merged [start,
+    end) integer ranges.  Set arithmetic is a linear merge of those ranges;
+    the CIDR prefixes IPy deals in are only generated on output (iteration,
+    ``prefixes``, and string representation).
+
+    IPSets are immutable and interned: there is only ever one live IPSet
+    for each distinct set of addresses, so IPSets can be hashed, and are
+    equal exactly when they are identical."""
+
+    def __new__(cls, iterable=[]):
+        if isinstance(iterable, IPSet):
+            return iterable
+        ranges = (_ip_range(ip) for ip in iterable)
+        return cls._from_flat(_normalize(r for r in ranges if r))
+
+    def __init__(self, iterable=[]):
+        # everything is done in __new__
+        pass
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Create an IPSet from an iterable of (start, end) integer pairs,
+        where each range includes start but not end."""
+        return cls._from_flat(_normalize(ranges))
+
+    @classmethod
+    def _from_flat(cls, flat):
+        new = _interned.get(flat)
+        if new is None:
+            new = super(IPSet, cls).__new__(cls)
+            new._ranges = flat
+            new._prefixes = None
+            new._hash = hash(flat)
+            _interned[flat] = new
+        return new
+
+    @property
+    def ranges(self):
+        """The (start, end) integer ranges in this set, in order"""
+        r = self._ranges
+        return zip(r[::2], r[1::2])
+
+    @property
+    def prefixes(self):
+        if self._prefixes is None:
+            r = self._ranges
+            self._prefixes = list(itertools.chain.from_iterable(
+                _range_prefixes(r[i], r[i + 1]) for i in xrange(0, len(r), 2)))
+        return self._prefixes
+
+    def __iter__(self):
+        return iter(self.prefixes)
+
+    def len(self):
+        r = self._ranges
+        return sum(r[1::2]) - sum(r[::2])
+
+    def __len__(self):
+        return self.len()
+
+    def __nonzero__(self):
+        return bool(self._ranges)
+
+    def __contains__(self, ip):
+        if isinstance(ip, IPSet):
+            return not _difference(ip._ranges, self._ranges)
+        range = _ip_range(ip)
+        if range is None:
+            return False
+        start, end = range
+        i = bisect.bisect_right(self._ranges, start)
+        # an odd index means start falls within the range beginning at i - 1
+        return bool(i % 2) and end <= self._ranges[i]
 
     def isdisjoint(self, other):
-        left = iter(self.prefixes)
-        right = iter(other.prefixes)
-        try:
-            l = left.next()
-            r = right.next()
-            while True:
-                if l in r or r in l:
-                    return False
-                if l < r:
-                    l = left.next()
-                else:
-                    r = right.next()
-        except StopIteration:
-            return True
+        return _isdisjoint(self._ranges, _coerce(other)._ranges)
 
     def __and__(self, other):
-        left = iter(self.prefixes)
-        right = iter(other.prefixes)
-        result = []
-        try:
-            l = left.next()
-            r = right.next()
-            while True:
-                if l in r:
-                    result.append(l)
-                    l = left.next()
-                    continue
-                elif r in l:
-                    result.append(r)
-                    r = right.next()
-                    continue
-                if l < r:
-                    l = left.next()
-                else:
-                    r = right.next()
-        except StopIteration:
-            return IPSet(result)
+        return _operate(_intersection, self, _coerce(other))
 
-    # see https://github.com/haypo/python-ipy/pull/25
-    def __contains__(self, ip):
-        valid_masks = self.prefixtable.keys()
-        if isinstance(ip, IP):
-            #Don't dig through more-specific ranges
-            ip_mask = ip._prefixlen
-            valid_masks = [x for x in valid_masks if x <= ip_mask]
-        for mask in sorted(valid_masks):
-            i = bisect.bisect(self.prefixtable[mask], ip)
-            # Because of sorting order, a match can only occur in the prefix
-            # that comes before the result of the search.
-            if i and ip in self.prefixtable[mask][i - 1]:
-                return True
-
-    # override to create instances of the correct class
     def __add__(self, other):
-        return IPSet(self.prefixes + other.prefixes)
+        return _operate(_union, self, _coerce(other))
+
+    __or__ = __add__
 
-    # override to create instances of the correct class
     def __sub__(self, other):
-        new = IPSet(self.prefixes)
-        for prefix in other:
-            new.discard(prefix)
-        return new
+        return _operate(_difference, self, _coerce(other))
+
+    # IPSets are used as values throughout fwunit, so the in-place operators
+    # return new instances rather than modifying a set that may be shared
+    __iadd__ = __ior__ = __add__
+    __iand__ = __and__
+    __isub__ = __sub__
+
+    def add(self, value):
+        raise TypeError("IPSets are immutable; use + instead")
+
+    def discard(self, value):
+        raise TypeError("IPSets are immutable; use - instead")
 
     def __eq__(self, other):
-        return self.prefixes == other.prefixes
+        if isinstance(other, IPSet):
+            return self is other
+        if not isinstance(other, IPy.IPSet):
+            return False
+        return self is _coerce(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
 
     def __lt__(self, other):
-        return self.prefixes < other.prefixes
+        return self._ranges < _coerce(other)._ranges
+
+    def __repr__(self):
+        return 'IPSet([%s])' % ', '.join(map(repr, self.prefixes))
+
+    def __reduce__(self):
+        # unpickled IPSets are interned, too
+        return _unpickle_ipset, (self._ranges,)
+
+
+def _unpickle_ipset(flat):
+    return IPSet._from_flat(flat)
+
+
+class OperationMemo(object):
+    """A bounded LRU memo of the results of binary IPSet operations, keyed
+    on the (interned) operands.  The ``hits`` and ``misses`` counters can be
+    used to tune its size."""
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # key -> link, where links form a circular doubly-linked list of
+        # [prev, next, key, result] in order of use, oldest first
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __call__(self, op, a, b):
+        key = (op, a, b)
+        root = self._root
+        link = self._links.get(key)
+        if link is not None:
+            self.hits += 1
+            # move the link to the most-recently-used end
+            prev, next, _, result = link
+            prev[1] = next
+            next[0] = prev
+        else:
+            self.misses += 1
+            result = IPSet._from_flat(op(a._ranges, b._ranges))
+            if len(self._links) >= self.size:
+                oldest = root[1]
+                oldest[0][1] = oldest[1]
+                oldest[1][0] = oldest[0]
+                del self._links[oldest[2]]
+            link = self._links[key] = [None, None, key, result]
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+        return result
+
+
+# the OperationMemo in use, if any
+_memo = None
+
+
+def memoize_operations(size):
+    """Memoize the results of up to ``size`` IPSet operations (``&``, ``+``,
+    and ``-``), evicting the least recently used.  A size of 0 disables
+    memoization.  Returns the new OperationMemo, or None."""
+    global _memo
+    _memo = OperationMemo(size) if size else None
+    return _memo
+
+
+def _operate(op, a, b):
+    if _memo is not None:
+        return _memo(op, a, b)
+    return IPSet._from_flat(op(a._ranges, b._ranges))
+
+
+def _coerce(other):
+    if isinstance(other, IPSet):
+        return other
+    # a plain IPy.IPSet, or any other iterable of IPs
+    return IPSet(other)
+
+
+class IPSetIndex(object):
+    """An interval tree over the ranges of a list of IPSets, used to find the
+    IPSets overlapping a query without testing each one in turn."""
+
+    def __init__(self, ipsets):
+        intervals = []
+        for owner, ipset in enumerate(ipsets):
+            r = _coerce(ipset)._ranges
+            for i in xrange(0, len(r), 2):
+                intervals.append((r[i], r[i + 1], owner))
+        self._root = self._build(intervals)
+
+    @classmethod
+    def _build(cls, intervals):
+        # each node is (center, by_start, by_end, left, right), where by_start
+        # and by_end hold the intervals containing center, sorted by
+        # increasing start and decreasing end, respectively
+        if not intervals:
+            return None
+        intervals.sort()
+        center = intervals[len(intervals) // 2][0]
+        here, left, right = [], [], []
+        for iv in intervals:
+            if iv[1] <= center:
+                left.append(iv)
+            elif iv[0] > center:
+                right.append(iv)
+            else:
+                here.append(iv)
+        by_end = sorted(here, key=lambda iv: -iv[1])
+        return (center, here, by_end, cls._build(left), cls._build(right))
+
+    def overlapping(self, ipset):
+        """Return the sorted indexes of the IPSets overlapping ``ipset``"""
+        return sorted(self._overlapping(ipset))
+
+    def _overlapping(self, ipset):
+        found = set()
+        r = _coerce(ipset)._ranges
+        for i in xrange(0, len(r), 2):
+            start, end = r[i], r[i + 1]
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                if node is None:
+                    continue
+                center, by_start, by_end, left, right = node
+                if end <= center:
+                    for iv in by_start:
+                        if iv[0] >= end:
+                            break
+                        found.add(iv[2])
+                    stack.append(left)
+                elif start > center:
+                    for iv in by_end:
+                        if iv[1] <= start:
+                            break
+                        found.add(iv[2])
+                    stack.append(right)
+                else:
+                    found.update(iv[2] for iv in by_start)
+                    stack.append(left)
+                    stack.append(right)
+        return found
+
+
+class IPSetArray(object):
+    """A sequence of IPSets packed into NumPy arrays of range starts, range
+    ends, and the index of the IPSet owning each range, for vectorized bulk
+    operations."""
+
+    # upper bound on the number of range pairs compared in one numpy operation
+    chunk_size = 1 << 22
+
+    def __init__(self, ipsets):
+        self.ipsets = [_coerce(s) for s in ipsets]
+        flat = [s._ranges for s in self.ipsets]
+        counts = numpy.array([len(r) // 2 for r in flat], dtype=numpy.int64)
+        ranges = numpy.fromiter(itertools.chain.from_iterable(flat),
+                                dtype=numpy.int64,
+                                count=2 * int(counts.sum()))
+        self.starts = ranges[0::2]
+        self.ends = ranges[1::2]
+        self.owners = numpy.repeat(
+            numpy.arange(len(self.ipsets), dtype=numpy.int64), counts)
+
+    def __len__(self):
+        return len(self.ipsets)
+
+    def overlaps(self, other):
+        """Return a sorted array of codes ``i * len(other) + j`` for each pair
+        of ``self[i]`` and ``other[j]`` that are not disjoint."""
+        found = []
+        n_other = len(other.starts)
+        if n_other:
+            step = max(1, self.chunk_size // n_other)
+            for c in xrange(0, len(self.starts), step):
+                starts = self.starts[c:c + step, numpy.newaxis]
+                ends = self.ends[c:c + step, numpy.newaxis]
+                left, right = numpy.nonzero(
+                    (starts < other.ends) & (other.starts < ends))
+                found.append(self.owners[c + left] * len(other)
+                             + other.owners[right])
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.unique(numpy.concatenate(found))
+
+
+# above this many (left, right) pairs, testing them all with NumPy is slower
+# than looking up each left in an IPSetIndex of the rights
+max_tested_pairs = 1 << 30
+
+
+def overlapping_pairs(lefts, rights):
+    """Given two sequences of equal-length tuples of IPSets (such as ``(src,
+    dst)`` pairs), return a sorted list of all ``(i, j)`` such that each
+    IPSet in ``lefts[i]`` overlaps the corresponding IPSet in ``rights[j]``.
+
+    When NumPy is available, all candidate pairs are tested at once.
+    Otherwise, or if there are too many pairs, each column of ``rights`` is
+    indexed, so that each left only visits the rights it overlaps."""
+    if not lefts or not rights:
+        return []
+    if numpy is None or len(lefts) * len(rights) > max_tested_pairs:
+        return _indexed_overlapping_pairs(lefts, rights)
+    codes = None
+    for column in xrange(len(lefts[0])):
+        col_codes = IPSetArray(l[column] for l in lefts).overlaps(
+            IPSetArray(r[column] for r in rights))
+        if codes is None:
+            codes = col_codes
+        else:
+            codes = numpy.intersect1d(codes, col_codes, assume_unique=True)
+    n = len(rights)
+    return [divmod(int(code), n) for code in codes]
+
+
+def _indexed_overlapping_pairs(lefts, rights):
+    indexes = [IPSetIndex([r[column] for r in rights])
+               for column in xrange(len(lefts[0]))]
+    pairs = []
+    for i, l in enumerate(lefts):
+        found = indexes[0]._overlapping(l[0])
+        for index, ipset in zip(indexes[1:], l[1:]):
+            if not found:
+                break
+            found &= index._overlapping(ipset)
+        pairs.extend((i, j) for j in sorted(found))
+    return pairs
 
 
 class IPPairs(object):
     """Reasonably compact representation of a set of source-destination pairs,
-    with the ability to do some basic arithmetic."""
+    with the ability to do some basic arithmetic.
+
+    Internally, this is a map from disjoint, sorted source ranges to
+    destination IPSets, with adjacent ranges that have the same destinations
+    merged.  That representation is canonical: two IPPairs containing the
+    same source-destination pairs compare equal, however they were
+    constructed."""
 
     def __init__(self, *pairs):
-        self._pairs = list(pairs)
-        self._optimize()
+        # each segment is (start, end, dst) for the source range [start, end)
+        self._segments = self._sweep(pairs)
+        self._pairs = None
+
+    @classmethod
+    def _from_segments(cls, segments):
+        new = cls.__new__(cls)
+        new._segments = segments
+        new._pairs = None
+        return new
+
+    @staticmethod
+    def _sweep(pairs):
+        events = []
+        dsts = []
+        dst_ids = {}  # dst ranges: index in dsts, so each dst is only unioned once
+        for src, dst in pairs:
+            src, dst = _coerce(src), _coerce(dst)
+            if not src or not dst:
+                continue
+            idx = dst_ids.get(dst._ranges)
+            if idx is None:
+                idx = dst_ids[dst._ranges] = len(dsts)
+                dsts.append(dst)
+            r = src._ranges
+            for i in xrange(0, len(r), 2):
+                events.append((r[i], 1, idx))
+                events.append((r[i + 1], -1, idx))
+        events.sort()
+
+        segments = []
+        active = {}  # dst index: number of active source ranges with that dst
+        dst = None
+        e = 0
+        while e < len(events):
+            pos = events[e][0]
+            started, ended = [], []
+            while e < len(events) and events[e][0] == pos:
+                _, delta, idx = events[e]
+                count = active.get(idx, 0) + delta
+                if count:
+                    active[idx] = count
+                    if delta > 0 and count == 1:
+                        started.append(idx)
+                else:
+                    del active[idx]
+                    ended.append(idx)
+                e += 1
+            if not active:
+                dst = None
+                continue
+            # destinations only added since the last segment can be unioned
+            # into its dst; otherwise start over from the active destinations
+            if dst is None or any(idx not in active for idx in ended):
+                if len(active) == 1:
+                    dst = dsts[next(iter(active))]
+                else:
+                    dst = IPSet._from_flat(_normalize(itertools.chain(
+                        *[dsts[idx].ranges for idx in active])))
+            elif started:
+                dst = IPSet._from_flat(reduce(
+                    _union, [dsts[idx]._ranges for idx in started], dst._ranges))
+            _append_segment(segments, pos, events[e][0], dst)
+        return segments
 
     def __iter__(self):
-        return self._pairs.__iter__()
+        if self._pairs is None:
+            # group the source ranges by destination, in source order
+            srcs_by_dst = {}
+            order = []
+            for start, end, dst in self._segments:
+                if dst._ranges not in srcs_by_dst:
+                    srcs_by_dst[dst._ranges] = (dst, [])
+                    order.append(dst._ranges)
+                srcs_by_dst[dst._ranges][1].extend((start, end))
+            self._pairs = [
+                (IPSet._from_flat(tuple(srcs_by_dst[k][1])), srcs_by_dst[k][0])
+                for k in order]
+        return iter(self._pairs)
 
     def __eq__(self, other):
-        # TODO: this can show equal IPPairs that have been constructed
-        # differently as different.  It's good enough for tests.
-        return self._pairs == other._pairs
+        if not isinstance(other, IPPairs):
+            return NotImplemented
+        return self._segments == other._segments
+
+    def __ne__(self, other):
+        if not isinstance(other, IPPairs):
+            return NotImplemented
+        return self._segments != other._segments
 
     def __repr__(self):
-        return 'IPPairs(*[\n%s\n])' % ('\n'.join("  " + 
-           '%r\n   -> %r' % p for p in self._pairs))
+        return 'IPPairs(*[\n%s\n])' % ('\n'.join("  " +
+           '%r\n   -> %r' % p for p in self))
 
     def __sub__(self, other):
-        new_pairs = []
-        empty = lambda pair: len(pair[0]) == 0 or len(pair[1]) == 0
-        # the approach here is to successively break pairs in self down where they overlap
-        # other, keeping only pairs that are completely disjoint with other.
-        pairs_to_consider = self._pairs[:]
-        while pairs_to_consider:
-            sa, da = pairs_to_consider.pop(0)
-            for sb, db in other._pairs:
-                # eliminate non-overlap
-                if sa.isdisjoint(sb) or da.isdisjoint(db):
-                    continue
-                for pair in (sa & sb, da - db), (sa - sb, da - db), (sa - sb, da & db):
-                    if not empty(pair):
-                        pairs_to_consider.append(pair)
-                break
-            else:
-                # no pairs in `other` overlapped sa/da, so we can keep it
-                new_pairs.append((sa, da))
-        return IPPairs(*new_pairs)
+        return IPPairs._from_segments(_merge_segments(
+            self._segments, other._segments, _sub_dsts))
+
+    def __nonzero__(self):
+        return bool(self._segments)
+
+    def differences(self, other):
+        """Return ``(self - other, other - self)``, calculated in a single
+        sweep over both"""
+        removed, added = [], []
+        for start, end, l, r in _elementary_segments(
+                self._segments, other._segments):
+            dst = _sub_dsts(l, r)
+            if dst:
+                _append_segment(removed, start, end, dst)
+            dst = _sub_dsts(r, l)
+            if dst:
+                _append_segment(added, start, end, dst)
+        return IPPairs._from_segments(removed), IPPairs._from_segments(added)
+
 
-    def _optimize(self):
-        if len(self._pairs) < 2:
+def _append_segment(segments, start, end, dst):
+    """Append a segment, merging it with the previous segment if they are
+    adjacent and have the same destinations"""
+    if segments:
+        last_start, last_end, last_dst = segments[-1]
+        if last_end == start and last_dst == dst:
+            segments[-1] = (last_start, end, last_dst)
             return
-        while True:
-            changed = False
-            for reverse in 1, 0:  # finish with non-reversed
-                self._pairs.sort(key=(lambda p: tuple(reversed(p)) if reverse else None))
-                i = len(self._pairs) - 2
-                while i >= 0:
-                    if self._pairs[i][reverse] == self._pairs[i+1][reverse]:
-                        if reverse:
-                            self._pairs[i] = (self._pairs[i][0] + self._pairs[i+1][0], self._pairs[i][1])
-                        else:
-                            self._pairs[i] = (self._pairs[i][0], self._pairs[i][1] + self._pairs[i+1][1])
-                        del self._pairs[i+1]
-                        changed = True
-                    i -= 1
-            if not changed:
-                break
+    segments.append((start, end, dst))
+
+
+def _sub_dsts(left, right):
+    if left is None or right is None:
+        return left
+    return left - right
+
+
+def _merge_segments(left, right, op):
+    """Sweep over two sorted segment lists, combining the destinations of
+    each elementary source range with ``op(left_dst, right_dst)``, where
+    either argument may be None if that side has no segment there."""
+    segments = []
+    for start, end, l, r in _elementary_segments(left, right):
+        dst = op(l, r)
+        if dst:
+            _append_segment(segments, start, end, dst)
+    return segments
 
-    def __nonzero__(self):
-        return len(self._pairs) != 0
 
+def _elementary_segments(left, right):
+    """Sweep over two sorted segment lists, generating (start, end, left_dst,
+    right_dst) for each elementary source range covered by either list, where
+    either destination may be None if that side has no segment there."""
+    nl, nr = len(left), len(right)
+    i = j = 0
+    pos = 0
+    while i < nl or j < nr:
+        # drop segments that end at or before the sweep position
+        if i < nl and left[i][1] <= pos:
+            i += 1
+            continue
+        if j < nr and right[j][1] <= pos:
+            j += 1
+            continue
+        l_start = max(left[i][0], pos) if i < nl else _IPV4_END
+        r_start = max(right[j][0], pos) if j < nr else _IPV4_END
+        start = min(l_start, r_start)
+        # the elementary range ends at the next boundary on either side
+        end = _IPV4_END
+        l = r = None
+        if l_start == start:
+            l = left[i][2]
+            end = left[i][1]
+        else:
+            end = l_start
+        if r_start == start:
+            r = right[j][2]
+            end = min(end, right[j][1])
+        else:
+            end = min(end, r_start)
+        yield start, end, l, r
+        pos = end
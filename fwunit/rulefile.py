@@ -0,0 +1,213 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# reading and writing rule files, in either JSON or a compact binary format
+
+import array
+import collections
+import json
+import mmap
+import struct
+import sys
+from fwunit import types
+from fwunit.ip import IPSet
+from fwunit.types import Rule
+
+FORMATS = ('json', 'binary')
+
+# The binary format is a header followed by a sequence of little-endian
+# uint32 tables, then a blob of UTF-8 string data:
+#
+#   ranges   (start, last) for each range, with last inclusive
+#   ipsets   offsets into ranges; ipset k is ranges[ipsets[k]:ipsets[k+1]]
+#   strings  offsets into the string data, likewise
+#   apps     (name string, first rule, rule count) for each app
+#   rules    (src ipset, dst ipset, name string) for each rule, grouped by app
+#
+# Identical IPSets and strings are stored only once.
+MAGIC = 'FWUNITR1'
+_header = struct.Struct('<8s6I')
+
+
+def write_rules(rules, filename, format='json'):
+    """Write a dictionary of rules, keyed by app, to filename"""
+    if format == 'json':
+        json.dump(dict(rules=types.to_jsonable(rules)), open(filename, 'w'))
+    elif format == 'binary':
+        with open(filename, 'wb') as f:
+            _write_binary(rules, f)
+    else:
+        raise ValueError("unknown rule file format {}".format(format))
+
+
+def load_rules(filename, lazy=False):
+    """Load a rules dictionary, keyed by app, from a file in either format.
+
+    If lazy is true, the result is a read-only LazyRules mapping which only
+    decodes each app's rules when they are first accessed."""
+    with open(filename, 'rb') as f:
+        is_binary = f.read(len(MAGIC)) == MAGIC
+    if is_binary:
+        rf = BinaryRuleFile(filename)
+        if lazy:
+            return LazyRules(rf.apps(), rf.rules_for_app)
+        return rf.rules()
+    jsonable = json.load(open(filename))['rules']
+    if lazy:
+        by_app = {}
+        for d in jsonable:
+            by_app.setdefault(d['app'], []).append(d)
+        return LazyRules(by_app, lambda app: types.from_jsonable(by_app[app])[app])
+    return types.from_jsonable(jsonable)
+
+
+class LazyRules(collections.Mapping):
+    """A read-only dictionary of rules, keyed by app, which calls decode(app)
+    to get the list of rules for each app the first time it is accessed."""
+
+    def __init__(self, apps, decode):
+        self._rules = dict.fromkeys(apps)
+        self._decode = decode
+
+    def __getitem__(self, app):
+        rules = self._rules[app]
+        if rules is None:
+            rules = self._rules[app] = self._decode(app)
+        return rules
+
+    def __contains__(self, app):
+        return app in self._rules
+
+    def __iter__(self):
+        return iter(self._rules)
+
+    def __len__(self):
+        return len(self._rules)
+
+
+class _Interner(object):
+
+    def __init__(self):
+        self.indexes = {}
+        self.values = []
+
+    def __getitem__(self, value):
+        try:
+            return self.indexes[value]
+        except KeyError:
+            idx = self.indexes[value] = len(self.values)
+            self.values.append(value)
+            return idx
+
+
+def _uint32s(values):
+    arr = array.array('I', values)
+    if sys.byteorder == 'big':  # pragma: no cover
+        arr.byteswap()
+    return arr.tostring()
+
+
+def _write_binary(rules, f):
+    ipsets = _Interner()
+    strings = _Interner()
+    app_table = []
+    rule_table = []
+    for app in sorted(rules):
+        app_table.extend([strings[app], len(rule_table) // 3, len(rules[app])])
+        for r in rules[app]:
+            rule_table.extend([ipsets[r.src._ranges], ipsets[r.dst._ranges],
+                               strings[r.name]])
+
+    range_table = []
+    ipset_offsets = [0]
+    for flat in ipsets.values:
+        for i in xrange(0, len(flat), 2):
+            range_table.extend([flat[i], flat[i + 1] - 1])
+        ipset_offsets.append(len(range_table) // 2)
+
+    string_data = [s.encode('utf-8') for s in strings.values]
+    string_offsets = [0]
+    for s in string_data:
+        string_offsets.append(string_offsets[-1] + len(s))
+
+    f.write(_header.pack(MAGIC, len(range_table) // 2, len(ipsets.values),
+                         len(strings.values), string_offsets[-1],
+                         len(app_table) // 3, len(rule_table) // 3))
+    for table in range_table, ipset_offsets, string_offsets, app_table, rule_table:
+        f.write(_uint32s(table))
+    f.write(''.join(string_data))
+
+
+class BinaryRuleFile(object):
+    """A memory-mapped binary rule file.  IPSets and strings are only decoded
+    when a rule referring to them is first materialized, and each is decoded
+    only once."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, n_ranges, n_ipsets, n_strings, n_string_bytes, n_apps,
+         n_rules) = _header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a binary rule file".format(filename))
+        offset = _header.size
+        self._ranges_at = offset
+        offset += 8 * n_ranges
+        self._ipsets_at = offset
+        offset += 4 * (n_ipsets + 1)
+        self._strings_at = offset
+        offset += 4 * (n_strings + 1)
+        self._apps_at = offset
+        offset += 12 * n_apps
+        self._rules_at = offset
+        offset += 12 * n_rules
+        self._string_data_at = offset
+
+        self._ipsets = [None] * n_ipsets
+        self._strings = [None] * n_strings
+        self._apps = {}
+        for i in xrange(n_apps):
+            name, first, count = struct.unpack_from(
+                '<3I', self._map, self._apps_at + 12 * i)
+            self._apps[self._string(name)] = (first, count)
+
+    def _string(self, idx):
+        s = self._strings[idx]
+        if s is None:
+            start, end = struct.unpack_from(
+                '<2I', self._map, self._strings_at + 4 * idx)
+            at = self._string_data_at
+            s = self._strings[idx] = \
+                self._map[at + start:at + end].decode('utf-8')
+        return s
+
+    def _ipset(self, idx):
+        ipset = self._ipsets[idx]
+        if ipset is None:
+            first, last = struct.unpack_from(
+                '<2I', self._map, self._ipsets_at + 4 * idx)
+            flat = list(struct.unpack_from(
+                '<%dI' % (2 * (last - first)), self._map,
+                self._ranges_at + 8 * first))
+            # convert the inclusive last addresses back to exclusive ends
+            flat[1::2] = [l + 1 for l in flat[1::2]]
+            ipset = self._ipsets[idx] = IPSet._from_flat(tuple(flat))
+        return ipset
+
+    def apps(self):
+        """Return the names of the apps in this file"""
+        return self._apps.keys()
+
+    def rules_for_app(self, app):
+        """Decode and return the list of rules for the given app"""
+        first, count = self._apps[app]
+        table = struct.unpack_from(
+            '<%dI' % (3 * count), self._map, self._rules_at + 12 * first)
+        return [Rule(src=self._ipset(table[i]), dst=self._ipset(table[i + 1]),
+                     app=app, name=self._string(table[i + 2]))
+                for i in xrange(0, len(table), 3)]
+
+    def rules(self):
+        """Decode and return all rules, as a dictionary keyed by app"""
+        return {app: self.rules_for_app(app) for app in self._apps}
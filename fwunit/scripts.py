@@ -7,11 +7,11 @@ import logging
 import sys
 import textwrap
 from fwunit import diff as diff_module
+from fwunit import ip
 from fwunit import log
-from fwunit import types
+from fwunit import rulefile
 from fwunit.analysis import config
 import pkg_resources
-import json
 import prettyip
 
 # always use prettyip to print IPSets
@@ -80,12 +80,21 @@ def main():
         if 'output' not in src_cfg:
             parser.error("source '{}' has no output".format(source))
         output = src_cfg['output']
+        format = src_cfg.get('format', 'json')
+        if format not in rulefile.FORMATS:
+            parser.error("source '{}' has unknown format {}".format(source, format))
 
+        memo = ip.memoize_operations(src_cfg.get('ipset_memo', 0))
         logger.warning("running %s", source)
-        rules = ep(src_cfg, cfg)
+        try:
+            rules = ep(src_cfg, cfg)
+        finally:
+            if memo:
+                logger.warning("IPSet operation memo: %d hits, %d misses",
+                               memo.hits, memo.misses)
+                ip.memoize_operations(0)
         logger.warning("writing resulting rules to %s", output)
-        json.dump(dict(rules=types.to_jsonable(rules)),
-                  open(output, "w"))
+        rulefile.write_rules(rules, output, format)
 
 
 def query():
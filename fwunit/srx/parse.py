@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import contextlib
 import lxml.etree as ET
 from . import show
 from fwunit.ip import IP, IPSet
@@ -24,6 +25,23 @@ def strip_namespaces(root):
             elem.tag = elem.tag[i+1:]
     return root
 
+def iterparse(stream, *tags):
+    """Incrementally parse the XML document read from stream, yielding each
+    element with one of the given tags (in any namespace) as soon as it is
+    complete, with namespaces stripped.  Each element is discarded once the
+    caller has finished with it, so memory use does not grow with the size of
+    the document."""
+    for _, elem in ET.iterparse(stream, events=('end',),
+                                tag=['{*}' + t for t in tags]):
+        yield strip_namespaces(elem)
+        # free this element and any already-processed siblings
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
 class Policy(object):
 
     def __init__(self):
@@ -231,16 +249,78 @@ class AddressBook(object):
         return addrbook
 
 
+class Throttle(object):
+    """Space out requests to the firewall, since downloading policies can
+    cause high load on its poor underpowered control plane.
+
+    After each request, the next is delayed by ``ratio`` times as long as the
+    request took.  The delay is scaled up (by at most ``max_backoff``) by how
+    much longer the request took than expected from the fastest latency and
+    throughput seen so far, so that the throttle backs off when the control
+    plane is under load.  A ratio of 0 disables the throttle."""
+
+    def __init__(self, ratio=1.0, minimum=0.1, max_backoff=10.0):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.max_backoff = max_backoff
+        self._latency = None
+        self._throughput = None
+        self._next = 0
+
+    @contextlib.contextmanager
+    def stream(self, ssh_connection, request):
+        """Context manager giving a file-like stream of the output of the
+        request.  Since the output is parsed as it arrives, the request's
+        duration includes the time to consume the stream."""
+        time.sleep(max(0, self._next - time.time()))
+        start = time.time()
+        stream = _CountingStream(ssh_connection.stream(request))
+        yield stream
+        duration = time.time() - start
+        self._next = time.time() + self.delay(duration, stream.size)
+
+    def delay(self, duration, size):
+        """Record a request of size bytes which took duration seconds, and
+        return the time to wait before the next request"""
+        if self._latency is None or duration < self._latency:
+            self._latency = duration
+        if duration > self._latency:
+            throughput = size / (duration - self._latency)
+            if self._throughput is None or throughput > self._throughput:
+                self._throughput = throughput
+        expected = self._latency
+        if self._throughput:
+            expected += size / self._throughput
+        backoff = min(self.max_backoff, duration / expected) if expected else 1.0
+        delay = self.ratio * max(self.minimum, duration * max(1.0, backoff))
+        log.debug("request took %.2fs; throttling for %.2fs", duration, delay)
+        return delay
+
+
+class _CountingStream(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.size += len(data)
+        return data
+
+
 class Firewall(object):
 
     def parse(self, cfg):
         ssh_connection = show.Connection(cfg)
+        throttle = Throttle(ratio=cfg.get('throttle', 1.0))
 
         #: list of security zones
         self.zones = self._parse_zones(ssh_connection)
 
         #: list of Policy instances
-        self.policies = self._parse_policies(ssh_connection)
+        self.policies = self._parse_policies(
+            ssh_connection, throttle, cfg.get('policy_download', 'zone-pairs'))
 
         #: list of Route instances from 'inet.0'
         self.routes = self._parse_routes(ssh_connection)
@@ -248,85 +328,100 @@ class Firewall(object):
         #: list of AddressBook instances
         self.address_books = self._parse_address_books(ssh_connection)
 
-    def _parse_policies(self, ssh_connection):
-        policies = []
+    def _parse_policies(self, ssh_connection, throttle=None,
+                        download='zone-pairs'):
+        throttle = throttle or Throttle()
         zone_names = [z.name for z in self.zones]
-        num_downloads = len(zone_names) ** 2
-        count = 0
-        for from_zone in zone_names:
-            for to_zone in zone_names:
-                dl_start = time.time()
-                log.info(
-                    "downloading policies from-zone %s to-zone %s (%3.0f%%)",
-                    from_zone, to_zone, (100 * count / num_downloads))
-                count += 1
-                policies_xml = ssh_connection.show(
-                    'security policies from-zone %s to-zone %s' % (from_zone, to_zone))
-                dl_duration = time.time() - dl_start
-
-                log.info(
-                    "parsing policies from-zone %s to-zone %s", from_zone, to_zone)
-                sspe = ET.fromstring(policies_xml)
-
-                # downloading zones can cause high load on the poor underpowered control
-                # plane, so we sleep as long as the query took
-                time.sleep(max(0.1, dl_start + 2 * dl_duration - time.time()))
-
-                for elt in sspe.findall('.//security-context'):
-                    from_zone = elt.find(
-                        './context-information/source-zone-name').text
-                    to_zone = elt.find(
-                        './context-information/destination-zone-name').text
-                    for pol_elt in elt.findall('./policies/policy-information'):
-                        policy = Policy._from_xml(from_zone, to_zone, pol_elt)
-                        policies.append(policy)
+        policies = []
+        if download == 'all':
+            log.info("downloading and parsing all policies")
+            with throttle.stream(ssh_connection, 'security policies') as stream:
+                policies.extend(self._parse_zone_policies(stream, set(zone_names)))
+        elif download == 'zone-pairs':
+            num_downloads = len(zone_names) ** 2
+            count = 0
+            for from_zone in zone_names:
+                for to_zone in zone_names:
+                    log.info(
+                        "downloading and parsing policies from-zone %s to-zone %s (%3.0f%%)",
+                        from_zone, to_zone, (100 * count / num_downloads))
+                    count += 1
+                    request = 'security policies from-zone %s to-zone %s' % (
+                        from_zone, to_zone)
+                    with throttle.stream(ssh_connection, request) as stream:
+                        policies.extend(self._parse_zone_policies(stream))
+        else:
+            raise RuntimeError("unknown policy_download {}".format(download))
 
         # look for global policies
         log.info("downloading global policy")
-        policies_xml = ssh_connection.show('security policies global')
-        spg = ET.fromstring(policies_xml)
-        elt = spg.find('.//security-context')
-        if elt is not None:
-            for pol_elt in elt.findall('./policies/policy-information'):
-                policy = Policy._from_xml(None, None, pol_elt)
-                policies.append(policy)
+        with throttle.stream(ssh_connection, 'security policies global') as stream:
+            for from_zone, to_zone, pol_elt in self._iter_policies(stream):
+                # only the first security context is global
+                if from_zone is None and to_zone is None:
+                    policies.append(Policy._from_xml(None, None, pol_elt))
 
         return policies
 
-    def _parse_routes(self, ssh_connection):
-        log.info("downloading routes")
-        route_xml = ssh_connection.show('route')
+    def _iter_policies(self, stream):
+        # yield (from_zone, to_zone, policy-information element) for each
+        # policy in the stream; the zones are None in the global context
+        from_zone = to_zone = None
+        for elt in iterparse(stream, 'context-information', 'policy-information'):
+            if elt.tag == 'context-information':
+                from_zone = elt.findtext('./source-zone-name')
+                to_zone = elt.findtext('./destination-zone-name')
+            else:
+                yield from_zone, to_zone, elt
+
+    def _parse_zone_policies(self, stream, zone_names=None):
+        # parse the per-zone-pair policies in the stream, skipping the global
+        # context and, if zone_names is given, any unknown zones
+        policies = []
+        for from_zone, to_zone, pol_elt in self._iter_policies(stream):
+            if from_zone is None or to_zone is None:
+                continue
+            if zone_names is not None and (
+                    from_zone not in zone_names or to_zone not in zone_names):
+                continue
+            policies.append(Policy._from_xml(from_zone, to_zone, pol_elt))
+        return policies
 
-        log.info("parsing routes")
-        sre = strip_namespaces(ET.fromstring(route_xml))
+    def _parse_routes(self, ssh_connection):
+        log.info("downloading and parsing routes")
         routes = []
-        for table in sre.findall('.//route-table'):
-            if table.findtext('table-name') == 'inet.0':
-                for rt_elt in table.findall('rt'):
-                    route = Route._from_xml(rt_elt)
+        table_name = None
+        done = False
+        for elt in iterparse(ssh_connection.stream('route'),
+                             'table-name', 'rt', 'route-table'):
+            if done:
+                continue  # consume the rest of the output
+            if elt.tag == 'table-name':
+                table_name = elt.text
+            elif elt.tag == 'rt':
+                if table_name == 'inet.0':
+                    route = Route._from_xml(elt)
                     if route:
                         routes.append(route)
-                return routes
-        return []
+            elif table_name == 'inet.0':
+                # only the first inet.0 table is used
+                done = True
+            else:
+                table_name = None
+        return routes
 
     def _parse_zones(self, ssh_connection):
-        log.info("downloading zones")
-        zones_xml = ssh_connection.show('configuration security zones')
-
-        log.info("parsing zones")
-        scsze = ET.fromstring(zones_xml)
+        log.info("downloading and parsing zones")
         zones = []
-        for sz in scsze.findall('.//security-zone'):
+        stream = ssh_connection.stream('configuration security zones')
+        for sz in iterparse(stream, 'security-zone'):
             zones.append(Zone._from_xml(sz))
         return zones
 
     def _parse_address_books(self, ssh_connection):
-        log.info("downloading non-zone address books")
-        addrbooks_xml = ssh_connection.show('configuration security address-book')
-
-        log.info("parsing address books")
-        csab = ET.fromstring(addrbooks_xml)
+        log.info("downloading and parsing non-zone address books")
         address_books = []
-        for ab in csab.findall('.//address-book'):
+        stream = ssh_connection.stream('configuration security address-book')
+        for ab in iterparse(stream, 'address-book'):
             address_books.append(AddressBook._from_xml(ab))
         return address_books
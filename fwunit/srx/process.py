@@ -2,7 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
 import itertools
+import multiprocessing
 from fwunit.ip import IPSet, IPPairs
 from fwunit.types import Rule
 from .parse import Policy
@@ -11,9 +13,11 @@ from logging import getLogger
 
 logger = getLogger(__name__)
 
-def policies_to_rules(app_map, firewall):
+def policies_to_rules(app_map, firewall, workers=1, state=None):
     """Process the data in a parse.Firewall instance into a list of non-overlapping
-    Rule instances, suitable for queries"""
+    Rule instances, suitable for queries.  If workers is greater than one, zone
+    pairs are processed in that many worker processes.  See process_rules for
+    the state argument."""
     interface_ips = process_interface_ips(firewall.routes)
     zone_nets = process_zone_nets(firewall.zones, interface_ips)
     policies_by_zone_pair = process_policies_by_zone_pair(firewall.policies)
@@ -26,7 +30,7 @@ def policies_to_rules(app_map, firewall):
         firewall.zones, policies_by_zone_pair, addrbooks_per_zone, global_addrbook)
     return process_rules(app_map, firewall.policies, zone_nets,
                          policies_by_zone_pair, src_per_policy,
-                         dst_per_policy)
+                         dst_per_policy, workers=workers, state=state)
 
 
 def process_interface_ips(routes):
@@ -174,7 +178,13 @@ def process_address_sets_per_policy(zones, policies_by_zone_pair,
 
 
 def process_rules(app_map, policies, zone_nets, policies_by_zone_pair,
-                  src_per_policy, dst_per_policy):
+                  src_per_policy, dst_per_policy, workers=1, state=None):
+    """Process policies into simplified rules, one zone pair at a time.
+
+    If state is given, it is a dictionary used to remember each zone pair's
+    results between runs, along with a fingerprint of that zone pair's
+    inputs.  Only zone pairs whose fingerprint has changed are recomputed,
+    and state is updated in place."""
     logger.info("processing rules")
     # turn policies into a list of Rules (permit only), limited by zone,
     # that do not overlap.  The tricky bit here is processing policies in
@@ -182,12 +192,12 @@ def process_rules(app_map, policies, zone_nets, policies_by_zone_pair,
     # (from_zone, to_zone, app) tuple.  The other tricky bit is handling
     # the application "any", which we treat as including all applications
     # used anywhere, and also record in a special "@@other" app.
-    rules_by_app = {}
     all_apps = set(itertools.chain(*[p.applications for p in policies]))
     all_apps = all_apps | set(app_map.keys())
     all_apps.discard('any')
     global_policies = policies_by_zone_pair.get((None, None), [])
     global_policies.sort(key=lambda p: p.sequence)
+    zone_pairs = []
     for from_zone, to_zone in itertools.product(zone_nets, zone_nets):
         zpolicies = sorted(policies_by_zone_pair.get((from_zone, to_zone), []),
                            key=lambda p: p.sequence)
@@ -195,40 +205,47 @@ def process_rules(app_map, policies, zone_nets, policies_by_zone_pair,
         # http://www.juniper.net/documentation/en_US/junos12.1x44/topics/concept/security-policy-global-policy-overview.html
         # so the two are simply concatenated here.
         zpolicies += global_policies
-        logger.debug(" from-zone %s to-zone %s (%d policies)", from_zone, to_zone,
-                     len(zpolicies))
-        rule_count = 0
-        apps = set(itertools.chain(*[p.applications for p in zpolicies]))
-        if 'any' in apps:
-            apps = all_apps
-        for app in apps | set(['@@other']):
-            mapped_app = app_map[app]
-            # for each app, count down the IP pairs that have not matched a
-            # rule yet, starting with the zones' IP spaces.  This simulates sequential
-            # processing of the policies.
-            remaining_pairs = IPPairs(
-                (zone_nets[from_zone], zone_nets[to_zone]))
-            rules = rules_by_app.setdefault(mapped_app, [])
-            for pol in zpolicies:
-                if app not in pol.applications and 'any' not in pol.applications:
-                    continue
-                src = src_per_policy[pol]
-                dst = dst_per_policy[pol]
-                # if the policy is a "permit", add rules for each
-                # src/destination pair
-                if pol.action == 'permit':
-                    for s, d in remaining_pairs:
-                        s = s & src
-                        d = d & dst
-                        if len(s) and len(d):
-                            rules.append(Rule(s, d, mapped_app, pol.name))
-                            rule_count += 1
-                # regardless, consider this src/dst pair matched
-                remaining_pairs = remaining_pairs - IPPairs((src, dst))
-                # if we've matched everything, we're done
-                if not remaining_pairs:
-                    break
-        logger.debug(" from-zone %s to-zone %s => %d rules", from_zone, to_zone, rule_count)
+        # pair each policy with its addresses, so that the zone pairs can be
+        # processed independently (possibly in another process)
+        zone_pairs.append((from_zone, to_zone,
+                           zone_nets[from_zone], zone_nets[to_zone],
+                           [(pol, src_per_policy[pol], dst_per_policy[pol])
+                            for pol in zpolicies]))
+
+    if state is None:
+        state = {}
+    keys = [zp[:2] for zp in zone_pairs]
+    fingerprints = [zone_pair_fingerprint(app_map, all_apps, *zp)
+                    for zp in zone_pairs]
+    stale = [i for i, key in enumerate(keys)
+             if state.get(key, (None, None))[0] != fingerprints[i]]
+    logger.info(" %d of %d zone pairs changed", len(stale), len(zone_pairs))
+
+    if workers > 1 and len(stale) > 1:
+        logger.info(" using %d worker processes", workers)
+        pool = multiprocessing.Pool(workers, _init_worker, (app_map, all_apps))
+        try:
+            # imap returns results in order, so the merge is deterministic
+            computed = list(pool.imap(_process_zone_pair_worker,
+                                      [zone_pairs[i] for i in stale]))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        computed = [process_zone_pair(app_map, all_apps, *zone_pairs[i])
+                    for i in stale]
+
+    for i, result in zip(stale, computed):
+        state[keys[i]] = (fingerprints[i], result)
+    # forget zone pairs that no longer exist
+    for key in set(state) - set(keys):
+        del state[key]
+    results = [state[key][1] for key in keys]
+
+    rules_by_app = {'@@other': []}
+    for app_rules in results:
+        for mapped_app, rules in app_rules:
+            rules_by_app.setdefault(mapped_app, []).extend(rules)
 
     # only include @@other if it's used
     if not rules_by_app['@@other']:
@@ -236,3 +253,88 @@ def process_rules(app_map, policies, zone_nets, policies_by_zone_pair,
 
     # simplify and return the result
     return simplify_rules(rules_by_app)
+
+
+def process_zone_pair(app_map, all_apps, from_zone, to_zone, from_net, to_net,
+                      zpolicies):
+    """Process the policies for a single zone pair, given as a list of
+    (policy, src, dst) in priority order, into a list of (app, rules) for
+    each application."""
+    logger.debug(" from-zone %s to-zone %s (%d policies)", from_zone, to_zone,
+                 len(zpolicies))
+    rule_count = 0
+    result = []
+    apps = set(itertools.chain(*[p.applications for p, _, _ in zpolicies]))
+    if 'any' in apps:
+        apps = all_apps
+    # apps matched by exactly the same policies get the same rules, so only
+    # calculate those once per equivalence class.  Most apps are only matched
+    # by 'any' policies.
+    by_policies = {}
+    for app in apps | set(['@@other']):
+        mapped_app = app_map[app]
+        matching = tuple(i for i, (pol, _, _) in enumerate(zpolicies)
+                         if app in pol.applications or 'any' in pol.applications)
+        if matching not in by_policies:
+            by_policies[matching] = _process_policies(
+                from_net, to_net, [zpolicies[i] for i in matching])
+        rules = [Rule(s, d, mapped_app, name)
+                 for s, d, name in by_policies[matching]]
+        rule_count += len(rules)
+        result.append((mapped_app, rules))
+    logger.debug(" from-zone %s to-zone %s => %d rules (%d distinct)",
+                 from_zone, to_zone, rule_count, len(by_policies))
+    return result
+
+
+def _process_policies(from_net, to_net, zpolicies):
+    # count down the IP pairs that have not matched a rule yet, starting with
+    # the zones' IP spaces.  This simulates sequential processing of the
+    # policies, all of which match the app.  Returns (src, dst, name) for
+    # each permitted flow.
+    remaining_pairs = IPPairs((from_net, to_net))
+    permitted = []
+    for pol, src, dst in zpolicies:
+        # if the policy is a "permit", add rules for each
+        # src/destination pair
+        if pol.action == 'permit':
+            for s, d in remaining_pairs:
+                s = s & src
+                d = d & dst
+                if len(s) and len(d):
+                    permitted.append((s, d, pol.name))
+        # regardless, consider this src/dst pair matched
+        remaining_pairs = remaining_pairs - IPPairs((src, dst))
+        # if we've matched everything, we're done
+        if not remaining_pairs:
+            break
+    return permitted
+
+
+def zone_pair_fingerprint(app_map, all_apps, from_zone, to_zone, from_net,
+                          to_net, zpolicies):
+    """Return a string which changes whenever any input to process_zone_pair
+    with the same arguments changes"""
+    apps = set(itertools.chain(*[p.applications for p, _, _ in zpolicies]))
+    if 'any' in apps:
+        apps = all_apps
+    inputs = (
+        from_zone, to_zone, from_net.ranges, to_net.ranges,
+        sorted((app, app_map[app]) for app in apps | set(['@@other'])),
+        [(p.name, p.applications, p.action, src.ranges, dst.ranges)
+         for p, src, dst in zpolicies],
+    )
+    return hashlib.sha1(repr(inputs)).hexdigest()
+
+
+# state shared by all tasks in a worker process, set by _init_worker
+_worker_args = None
+
+
+def _init_worker(app_map, all_apps):
+    global _worker_args
+    _worker_args = (app_map, all_apps)
+
+
+def _process_zone_pair_worker(zone_pair):
+    return process_zone_pair(*(_worker_args + zone_pair))
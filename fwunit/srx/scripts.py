@@ -5,7 +5,36 @@
 from .parse import Firewall
 from .process import policies_to_rules
 from fwunit import common
+import cPickle
 import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# bump this when the format of the incremental state changes
+STATE_VERSION = 2
+
+
+def load_state(filename):
+    """Load incremental processing state from filename, returning an empty
+    state if it does not exist or cannot be read"""
+    if not os.path.exists(filename):
+        return {}
+    try:
+        version, state = cPickle.load(open(filename, 'rb'))
+    except Exception as e:
+        logger.warning("could not load incremental state from %s: %s", filename, e)
+        return {}
+    if version != STATE_VERSION:
+        return {}
+    return state
+
+
+def save_state(filename, state):
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        cPickle.dump((STATE_VERSION, state), f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, filename)
 
 
 def run(cfg, fwunit_cfg):
@@ -13,4 +42,10 @@ def run(cfg, fwunit_cfg):
     app_map = common.ApplicationMap(cfg)
     firewall = Firewall()
     firewall.parse(cfg)
-    return policies_to_rules(app_map, firewall)
+    state_file = cfg.get('incremental_state')
+    state = load_state(state_file) if state_file else None
+    rules = policies_to_rules(app_map, firewall, workers=cfg.get('workers', 1),
+                              state=state)
+    if state_file:
+        save_state(state_file, state)
+    return rules
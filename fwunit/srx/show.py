@@ -15,7 +15,12 @@ class Connection(object):
                          password=self.cfg['ssh_password'])
 
     def show(self, request):
+        return self.stream(request).read()
+
+    def stream(self, request):
+        """Like show, but return a file-like object from which the output
+        can be read as it arrives"""
         stdin, stdout, stderr = self.ssh.exec_command(
                 'show %s | display xml | no-more\n' % request,
                 timeout=240.0)
-        return stdout.read()
+        return stdout
@@ -2,15 +2,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from nose.tools import assert_raises
 from nose.tools import eq_
 import logging
+import os
+import shutil
+import tempfile
 import moto
+from mock import patch
 import boto.vpc
 from fwunit.ip import IP, IPSet
 from fwunit import common
 from fwunit.types import Rule
 from fwunit.aws import aws
 from fwunit.aws import process
+from fwunit.aws import snapshot
 
 mock = moto.mock_ec2()
 
@@ -124,3 +130,62 @@ def test_aws():
     })
 
     eq_(process.get_rules(aws_conn, app_map, regions, dynamic_subnets), RULES)
+
+
+def test_snapshot():
+    regions = ['us-east-1', 'us-west-2']
+    dynamic_subnets = ['dynamic']
+    app_map = common.ApplicationMap({
+        'application-map': {
+            '22/tcp': 'ssh',
+            '80-81/tcp': 'web',
+        },
+    })
+    recorder = snapshot.Recorder(aws.AWS())
+    rules = process.get_rules(recorder, app_map, regions, dynamic_subnets)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'snapshot')
+        recorder.snapshot.save(filename)
+        replay = snapshot.Snapshot.load(filename)
+    finally:
+        shutil.rmtree(tmpdir)
+    eq_(replay.all_regions(), regions)
+    eq_(process.get_rules(replay, app_map, regions, dynamic_subnets), rules)
+    eq_(process.get_rules(replay, app_map, None, dynamic_subnets), rules)
+    assert_raises(RuntimeError, lambda:
+                  process.get_rules(replay, app_map, ['eu-west-1'], dynamic_subnets))
+
+
+def test_aws_concurrency():
+    # fetching regions concurrently gives the same results
+    regions = ['us-east-1', 'us-west-2', 'eu-west-1']
+    serial, concurrent = aws.AWS(), aws.AWS(concurrency=3)
+    eq_(sorted(concurrent.get_all_subnets(regions)),
+        sorted(serial.get_all_subnets(regions)))
+    eq_(sorted(concurrent.get_all_instances(regions)),
+        sorted(serial.get_all_instances(regions)))
+
+
+def test_get_security_groups():
+    aws_conn = aws.AWS(concurrency=2)
+    conn = aws_conn.get_ec2_connection('us-east-1')
+    sgs = conn.get_all_security_groups(groupnames=['admin_ssh', 'webapp'])
+    sgids = [process.SecurityGroupId(sg.id, 'us-east-1') for sg in sgs]
+    got = aws_conn.get_security_groups(sgids)
+    eq_(sorted(got), sorted(sgids))
+    eq_(sorted(sg.name for sg in got.itervalues()), ['admin_ssh', 'webapp'])
+    eq_(aws_conn.get_security_groups([]), {})
+
+
+def test_get_security_groups_pages():
+    aws_conn = aws.AWS()
+    conn = aws_conn.get_ec2_connection('us-east-1')
+    sgs = conn.get_all_security_groups(groupnames=['admin_ssh', 'webapp'])
+    sgids = [process.SecurityGroupId(sg.id, 'us-east-1') for sg in sgs]
+    aws_conn.max_group_ids = 1
+    with patch.object(conn, 'get_all_security_groups',
+                      wraps=conn.get_all_security_groups) as get_all:
+        got = aws_conn.get_security_groups(sgids)
+    eq_(get_all.call_count, 2)
+    eq_(sorted(got), sorted(sgids))
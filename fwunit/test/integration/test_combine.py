@@ -3,9 +3,13 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from nose.tools import eq_
+from nose.tools import ok_
+import mock
+from fwunit import ip
 from fwunit.types import Rule
 from fwunit.combine import process
 from fwunit.test.util import ipset
+from fwunit.test.util import combine_sources
 
 RULES_10 = {
     'http': [
@@ -80,3 +84,15 @@ def test_combine():
         ]),
     })
 
+
+def test_combine_large():
+    # combine multi-thousand-rule sources, intersecting rules both by testing
+    # all pairs with NumPy (if installed) and by indexing them
+    def combine():
+        return process.combine(combine_sources.ADDRESS_SPACES,
+                               combine_sources.ROUTES,
+                               combine_sources.synthetic_sources(rules=3000))
+    res = combine()
+    ok_(sum(len(rules) for rules in res.itervalues()) > 1000)
+    with mock.patch.object(ip, 'numpy', None):
+        eq_(combine(), res)
@@ -48,6 +48,8 @@ def setup():
         shutil.rmtree('test_dir')
     os.makedirs('test_dir')
     os.chdir('test_dir')
+    # keep the rule cache out of the user's home directory
+    os.environ['FWUNIT_CACHE_DIR'] = os.path.join(os.getcwd(), 'cache')
     yaml.dump(FWUNIT_YAML,
               open('fwunit.yaml', "w"))
     json.dump(dict(rules=types.to_jsonable(RULES)),
@@ -56,6 +58,7 @@ def setup():
 
 def teardown():
     os.chdir(old_cwd)
+    del os.environ['FWUNIT_CACHE_DIR']
     sys.argv = old_sys_argv
 
     if os.path.exists('test_dir'):
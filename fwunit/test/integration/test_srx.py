@@ -2,6 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+import shutil
+import tempfile
 from fwunit.srx import scripts
 from nose.tools import eq_, with_setup
 from fwunit.ip import IP, IPSet
@@ -140,3 +143,63 @@ def test_run_global_policies_and_addrbook():
         ],
     }
     eq_(rules, exp)
+
+
+@with_setup(install, uninstall)
+def test_run_policy_download_all():
+    fake_cfg = {
+        'firewall': 'fw',
+        'ssh_username': 'uu',
+        'ssh_password': 'pp',
+        'throttle': 0,
+    }
+    for name, itfc in ('untrust', 'reth0'), ('trust', 'reth1'), ('dmz', 'reth2'):
+        z = F.add_zone(name)
+        F.add_interface(z, itfc)
+    F.add_address(F.zones['untrust'], 'untrust-host', '9.0.9.1/32')
+    F.add_address(F.zones['trust'], 'trust-host', '10.9.1.1/32')
+    F.add_addrbook('global')
+
+    F.add_policy(('trust', 'untrust'),
+                 dict(sequence=1, name='ssh', src='trust-host', dst='untrust-host', app='junos-ssh', action='permit'))
+    F.add_policy(('untrust', 'trust'),
+                 dict(sequence=1, name='http', src='any', dst='trust-host', app='junos-http', action='permit'))
+    F.add_policy('global',
+                 dict(sequence=10, name='ping', src='any', dst='any', app='junos-ping', action='permit'))
+
+    rules = scripts.run(fake_cfg, {})
+    eq_(len([r for r in F.requests if r.startswith('security policies')]), 3 * 3 + 1)
+
+    del F.requests[:]
+    fake_cfg['policy_download'] = 'all'
+    eq_(scripts.run(fake_cfg, {}), rules)
+    eq_([r for r in F.requests if r.startswith('security policies')],
+        ['security policies', 'security policies global'])
+
+
+@with_setup(install, uninstall)
+def test_run_incremental_state():
+    dir = tempfile.mkdtemp()
+    try:
+        fake_cfg = {
+            'firewall': 'fw',
+            'ssh_username': 'uu',
+            'ssh_password': 'pp',
+            'incremental_state': os.path.join(dir, 'state.pkl'),
+            'throttle': 0,
+        }
+        z = F.add_zone('untrust')
+        F.add_interface(z, 'reth0')
+        z = F.add_zone('trust')
+        F.add_address(z, 'trust-host', '10.9.1.1/32')
+        F.add_interface(z, 'reth1')
+        F.add_policy(('untrust', 'trust'),
+                     dict(sequence=1, name='http', src='any', dst='trust-host', app='junos-http', action='permit'))
+
+        rules = scripts.run(fake_cfg, {})
+        state = scripts.load_state(fake_cfg['incremental_state'])
+        eq_(sorted(state), [('trust', 'trust'), ('trust', 'untrust'),
+                            ('untrust', 'trust'), ('untrust', 'untrust')])
+        eq_(scripts.run(fake_cfg, {}), rules)
+    finally:
+        shutil.rmtree(dir)
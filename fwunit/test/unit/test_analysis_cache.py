@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import mock
+import os
+import shutil
+import tempfile
+from fwunit import rulefile
+from fwunit.analysis import cache
+from fwunit.test.util.test_rules import TEST_RULES
+from nose.tools import eq_, with_setup
+
+dir = None
+
+
+def make_dir():
+    global dir
+    dir = tempfile.mkdtemp()
+
+
+def remove_dir():
+    shutil.rmtree(dir)
+
+
+def env(**kwargs):
+    return mock.patch.dict(os.environ, kwargs)
+
+
+def write(name, format='json'):
+    filename = os.path.join(dir, name)
+    rulefile.write_rules(TEST_RULES, filename, format)
+    return filename
+
+
+@with_setup(make_dir, remove_dir)
+def test_cached_filename():
+    filename = write('rules.json')
+    with env(FWUNIT_CACHE_DIR=os.path.join(dir, 'cache')):
+        entry = cache.cached_filename(filename)
+        assert entry.startswith(os.path.join(dir, 'cache'))
+        eq_(rulefile.load_rules(entry), TEST_RULES)
+        eq_(cache.cached_filename(filename), entry)
+        # a copy of the same content shares the entry
+        shutil.copy(filename, os.path.join(dir, 'copy.json'))
+        eq_(cache.cached_filename(os.path.join(dir, 'copy.json')), entry)
+
+
+
+@with_setup(make_dir, remove_dir)
+def test_cached_filename_evicted_concurrently():
+    filename = write('rules.json')
+    with env(FWUNIT_CACHE_DIR=os.path.join(dir, 'cache')):
+        entry = cache.cached_filename(filename)
+        # another process evicts the entry just before it is touched
+        def utime(path, times):
+            os.unlink(path)
+            raise OSError(2, 'No such file or directory')
+        with mock.patch('os.utime', side_effect=utime):
+            eq_(cache.cached_filename(filename), entry)
+        eq_(rulefile.load_rules(entry), TEST_RULES)
+
+@with_setup(make_dir, remove_dir)
+def test_cached_filename_disabled():
+    filename = write('rules.json')
+    with env(FWUNIT_CACHE_DIR=''):
+        eq_(cache.cached_filename(filename), filename)
+
+
+@with_setup(make_dir, remove_dir)
+def test_cached_filename_binary():
+    filename = write('rules.bin', 'binary')
+    with env(FWUNIT_CACHE_DIR=os.path.join(dir, 'cache')):
+        eq_(cache.cached_filename(filename), filename)
+    assert not os.path.exists(os.path.join(dir, 'cache'))
+
+
+@with_setup(make_dir, remove_dir)
+def test_cached_filename_too_large():
+    filename = write('rules.json')
+    with env(FWUNIT_CACHE_DIR=os.path.join(dir, 'cache'), FWUNIT_CACHE_MB='0'):
+        eq_(cache.cached_filename(filename), filename)
+    eq_(os.listdir(os.path.join(dir, 'cache')), [])
+
+
+@with_setup(make_dir, remove_dir)
+def test_evict():
+    for i, size in enumerate([10, 20, 30]):
+        path = os.path.join(dir, '%d.rules' % i)
+        open(path, 'w').write('x' * size)
+        os.utime(path, (i, i))
+    open(os.path.join(dir, 'other'), 'w').write('x' * 100)
+    cache.evict(dir, 50)
+    eq_(sorted(os.listdir(dir)), ['1.rules', '2.rules', 'other'])
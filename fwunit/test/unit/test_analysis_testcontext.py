@@ -26,6 +26,7 @@ def setup_module():
     dir = tempfile.mkdtemp()
     old_cwd = os.getcwd()
     os.chdir(dir)
+    os.environ['FWUNIT_CACHE_DIR'] = os.path.join(dir, 'cache')
     open('fwunit.yaml', 'w').write(yaml.dump({
         'test_source': {
             'output': os.path.join(dir, 'test_source.json'),
@@ -39,6 +40,7 @@ def setup_module():
 def teardown_module():
     global old_cwd
     os.chdir(old_cwd)
+    del os.environ['FWUNIT_CACHE_DIR']
     shutil.rmtree(dir)
 
 def test_assertDenies():
@@ -74,3 +76,12 @@ def test_allApps_other():
 def test_assertAllApps():
     rules.assertAllApps('10.0.0.0/8', '10.0.9.2', set(['ssh', 'puppet']))
 
+
+def test_source_rules_replaced():
+    source = sources.Source(os.path.join(dir, 'test_source.json'))
+    eq_(source.sourcesFor('10.1.1.1', 'ssh'), ipset('10.0.0.0/8'))
+    # replacing the rules discards the indexes built from the old rules
+    source.rules = {'ssh': [types.Rule(src=ipset('20.0.0.0/8'),
+                                       dst=ipset('10.1.1.1'),
+                                       app='ssh', name='ssh')]}
+    eq_(source.sourcesFor('10.1.1.1', 'ssh'), ipset('20.0.0.0/8'))
@@ -0,0 +1,67 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from fwunit import common
+from fwunit.aws import process
+from fwunit.aws.snapshot import Snapshot
+from fwunit.test.util import ipset
+from nose.tools import eq_
+
+
+def make_snapshot():
+    snapshot = Snapshot()
+    snapshot.regions = set(['us-east-1'])
+    snapshot.subnets = {
+        'subnet-1': ('us-east-1', '10.0.0.0/24', {'Name': 'perhost'}),
+    }
+    snapshot.instances = {
+        'i-1': ('us-east-1', 'running', 'vpc-1', '10.0.0.1', ['sg-1'],
+                {'Name': 'web1'}),
+        'i-2': ('us-east-1', 'running', 'vpc-1', '10.0.0.2', ['sg-2'],
+                {'Name': 'db1'}),
+    }
+    snapshot.security_groups = {
+        ('us-east-1', 'sg-1'): ('web', [
+            ('tcp', '80', '80', [('0.0.0.0/0', None)]),
+        ], [
+            ('-1', None, None, [('0.0.0.0/0', None)]),
+        ]),
+        ('us-east-1', 'sg-2'): ('db', [
+            ('tcp', '22', '22', [(None, 'sg-1')]),
+        ], []),
+    }
+    return snapshot
+
+
+def test_any_app_rules():
+    app_map = common.ApplicationMap({
+        'application-map': {'22/tcp': 'ssh', '80/tcp': 'http', '443/tcp': 'https'},
+    })
+    rules = process.get_rules(make_snapshot(), app_map, None, [])
+    eq_(sorted(rules), ['*/any', '@@other', 'http', 'https', 'ssh'])
+
+    def without_app(app):
+        return sorted((r.src, r.dst, r.name) for r in rules[app])
+    # apps with no rules of their own get the same rules as each other
+    eq_(without_app('https'), without_app('*/any'))
+    # '@@other' only gets the '*/any' rules, without 'unoccupied/out'
+    unmanaged = ipset('0.0.0.0/0') - ipset('10.0.0.0/24')
+    eq_(without_app('@@other'), [(ipset('10.0.0.1'), unmanaged, 'web/out')])
+    # sg-1's egress to anything allows ssh to db1, via sg-2's ingress
+    db1 = ipset('10.0.0.2')
+    ssh_to_db = [r for r in rules['ssh'] if r.dst & db1 == db1]
+    eq_([(r.src, r.name) for r in ssh_to_db], [(ipset('10.0.0.1'), 'db/in+web/out')])
+
+
+def test_security_group_members():
+    # all members of a security group get its rules, together
+    snapshot = make_snapshot()
+    snapshot.instances['i-3'] = ('us-east-1', 'running', 'vpc-1', '10.0.0.3',
+                                 ['sg-1'], {'Name': 'web2'})
+    app_map = common.ApplicationMap({'application-map': {'80/tcp': 'http'}})
+    rules = process.get_rules(snapshot, app_map, None, [])
+    web = ipset('10.0.0.1', '10.0.0.3')
+    # everything but db1, which has no egress rules, can reach the web hosts
+    eq_([(r.src, r.name) for r in rules['http'] if r.dst == web],
+        [(ipset('0.0.0.0/0') - ipset('10.0.0.2'), 'unoccupied/out+web/in+web/out')])
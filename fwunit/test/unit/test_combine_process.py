@@ -8,6 +8,7 @@ from fwunit.common import simplify_rules
 from fwunit.test.util import ipset
 from nose.tools import eq_
 import contextlib
+import mock
 
 
 @contextlib.contextmanager
@@ -69,6 +70,9 @@ def test_other_app():
     sources = {'fw1.ord': ord_rules, 'fw1.lga': lga_rules}
     with no_simplify():
         result = process.combine(address_spaces, routes, sources)
+        # the sources are not modified
+        eq_(sorted(ord_rules), ['@@other', 'inboth', 'ordonly'])
+        eq_(sorted(lga_rules), ['@@other', 'inboth', 'lgaonly'])
         for apprules in result.itervalues():
             apprules.sort()
         eq_(result, {
@@ -91,6 +95,68 @@ def test_other_app():
         })
 
 
+def test_other_app_calculated_once():
+    # apps which are copies of '@@other' in every source for a pair of address
+    # spaces are only combined once for that pair
+    ord_rules = {
+        'app1': [Rule(ipset('1.1.0.0'), ipset('1.1.9.9'), 'app1', 'app1')],
+        'app2': [Rule(ipset('1.1.0.0'), ipset('1.1.9.9'), 'app2', 'app2')],
+        '@@other': [],
+    }
+    lga_rules = {
+        '@@other': [
+            Rule(ipset('65.1.0.0'), ipset('65.1.9.9'), '@@other', 'lgaother'),
+        ],
+    }
+    address_spaces = {
+        'ord': ipset('0.0.0.0/2'),
+        'lga': ipset('64.0.0.0/2'),
+    }
+    sources = {'fw1.ord': ord_rules, 'fw1.lga': lga_rules}
+    with no_simplify():
+        with mock.patch('fwunit.combine.process.combine_partitioned',
+                        wraps=process.combine_partitioned) as combine_partitioned:
+            result = process.combine(address_spaces, routes, sources)
+    # 4 routes for each of the 3 apps, but lga -> lga is the same for app1
+    # and app2
+    eq_(combine_partitioned.call_count, 11)
+    for app in 'app1', 'app2':
+        eq_(sorted(result[app]), sorted([
+            Rule(ipset('1.1.0.0'), ipset('1.1.9.9'), app, app),
+            Rule(ipset('65.1.0.0'), ipset('65.1.9.9'), app, 'lgaother'),
+        ]))
+
+
+def test_workers():
+    # combining apps in worker processes gives the same result
+    ord_rules = {
+        'app1': [Rule(ipset('1.1.0.0/16'), ipset('65.1.0.0/16'), 'app1', 'ord1')],
+        'app2': [Rule(ipset('1.2.0.0/16'), ipset('65.0.0.0/8'), 'app2', 'ord2')],
+        '@@other': [Rule(ipset('1.0.0.0/8'), ipset('65.1.2.0/24'), '@@other', 'ordother')],
+    }
+    lga_rules = {
+        'app1': [Rule(ipset('1.0.0.0/8'), ipset('65.1.1.0/24'), 'app1', 'lga1')],
+        'app3': [Rule(ipset('1.1.1.0/24'), ipset('65.1.0.0/16'), 'app3', 'lga3')],
+        '@@other': [Rule(ipset('1.0.0.0/8'), ipset('65.0.0.0/8'), '@@other', 'lgaother')],
+    }
+    address_spaces = {
+        'ord': ipset('0.0.0.0/2'),
+        'lga': ipset('64.0.0.0/2'),
+    }
+    routes = {
+        ('ord', 'ord'): ['fw1.ord'],
+        ('ord', 'lga'): ['fw1.ord', 'fw1.lga'],
+        ('lga', 'ord'): ['fw1.ord', 'fw1.lga'],
+        ('lga', 'lga'): ['fw1.lga'],
+    }
+
+    def sources():
+        return {'fw1.ord': dict(ord_rules), 'fw1.lga': dict(lga_rules)}
+    exp = process.combine(address_spaces, routes, sources())
+    eq_(process.combine(address_spaces, routes, sources(), workers=2), exp)
+    eq_(sorted(exp), ['@@other', 'app1', 'app2', 'app3'])
+
+
 def test_nonoverlapping_rules():
     lga_rules = {'app': [
         Rule(ipset('1.2.5.0/24'), ipset('2.2.5.0/24'), 'app', 'lga'),
@@ -206,48 +272,80 @@ def test_multiple_matches():
         ]))
 
 
-def test_rules_from_to_empty():
-    eq_(process.rules_from_to([], ipset('1.0.0.0/8'), ipset('2.0.0.0/8')),
-        [])
+SPACES = {
+    'local': ipset('1.0.0.0/8'),
+    'remote': ipset('2.0.0.0/8'),
+}
+
+
+def test_partition_rules_empty():
+    eq_(process.partition_rules({'app': []}, SPACES), {'app': {}})
 
 
-def test_rules_from_to_no_match_src():
+def test_partition_rules_no_match_src():
     rules = [
         Rule(src=ipset('3.0.0.0/24'), dst=ipset('2.0.0.0/8'), app='app', name='r'),
     ]
-    eq_(process.rules_from_to(rules, ipset('1.0.0.0/8'), ipset('2.0.0.0/8')),
-        [])
+    eq_(process.partition_rules({'app': rules}, SPACES), {'app': {}})
 
 
-def test_rules_from_to_no_match_dst():
+def test_partition_rules_no_match_dst():
     rules = [
         Rule(src=ipset('1.0.0.0/8'), dst=ipset('3.0.0.0/24'), app='app', name='r'),
     ]
-    eq_(process.rules_from_to(rules, ipset('1.0.0.0/8'), ipset('2.0.0.0/8')),
-        [])
+    eq_(process.partition_rules({'app': rules}, SPACES), {'app': {}})
 
 
-def test_rules_from_to_intersection():
+def test_partition_rules_intersection():
     rules = [
         Rule(src=ipset('0.0.0.0/7'), dst=ipset('2.0.1.0/24'), app='app', name='r'),
     ]
-    eq_(process.rules_from_to(rules, ipset('1.0.0.0/8'), ipset('2.0.0.0/8')), [
-        Rule(src=ipset('1.0.0.0/8'), dst=ipset('2.0.1.0/24'), app='app', name='r'),
-    ])
+    eq_(process.partition_rules({'app': rules}, SPACES), {'app': {
+        ('local', 'remote'): [
+            Rule(src=ipset('1.0.0.0/8'), dst=ipset('2.0.1.0/24'), app='app', name='r'),
+        ],
+    }})
+
+
+def test_partition_rules_multiple_spaces():
+    rules = [
+        Rule(src=ipset('1.0.0.0/8', '2.0.0.0/8'),
+             dst=ipset('1.2.0.0/16', '2.3.0.0/16'), app='app', name='r1'),
+        Rule(src=ipset('2.0.0.0/8'), dst=ipset('1.0.0.0/8', '2.0.0.0/8'),
+             app='app', name='r2'),
+    ]
+    eq_(process.partition_rules({'app': rules}, SPACES), {'app': {
+        ('local', 'local'): [
+            Rule(src=ipset('1.0.0.0/8'), dst=ipset('1.2.0.0/16'), app='app', name='r1'),
+        ],
+        ('local', 'remote'): [
+            Rule(src=ipset('1.0.0.0/8'), dst=ipset('2.3.0.0/16'), app='app', name='r1'),
+        ],
+        ('remote', 'local'): [
+            Rule(src=ipset('2.0.0.0/8'), dst=ipset('1.2.0.0/16'), app='app', name='r1'),
+            Rule(src=ipset('2.0.0.0/8'), dst=ipset('1.0.0.0/8'), app='app', name='r2'),
+        ],
+        ('remote', 'remote'): [
+            Rule(src=ipset('2.0.0.0/8'), dst=ipset('2.3.0.0/16'), app='app', name='r1'),
+            Rule(src=ipset('2.0.0.0/8'), dst=ipset('2.0.0.0/8'), app='app', name='r2'),
+        ],
+    }})
 
 
-def test_intersect_rules():
+def test_combine_partitioned():
     r1 = [
-        Rule(src=ipset('1.0.0.0/24'), dst=ipset('0.0.0.0/0'), app='app', name='r1'),
+        Rule(src=ipset('1.0.0.0/24'), dst=ipset('2.0.0.0/8'), app='app', name='r1'),
     ]
     r2 = [
-        Rule(src=ipset('1.0.0.10', '1.0.0.14'), dst=ipset('0.0.0.0/0'),
+        Rule(src=ipset('1.0.0.10', '1.0.0.14'), dst=ipset('2.0.0.0/8'),
              app='app', name='r2'),
     ]
     r3 = [
-        Rule(src=ipset('1.0.0.11', '1.0.0.14'), dst=ipset('0.0.0.0/0'),
+        Rule(src=ipset('1.0.0.11', '1.0.0.14'), dst=ipset('2.0.0.0/8'),
              app='app', name='r3'),
     ]
-    eq_(process.intersect_rules([r1, r2, r3], ipset('0.0.0.0/0'), ipset('2.0.0.0/8')), [
+    eq_(process.combine_partitioned([r1, r2, r3]), [
         Rule(src=ipset('1.0.0.14'), dst=ipset('2.0.0.0/8'), app='app', name='r1+r2+r3'),
     ])
+    eq_(process.combine_partitioned([r1]), r1)
+    eq_(process.combine_partitioned([r1, []]), [])
@@ -57,7 +57,7 @@ def test_run_one_route():
     exp_routes['ord', 'lax'] = set(['fw1.ord'])
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.ord'))
+        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.ord'), workers=1)
 
 
 def test_run_address_space_list():
@@ -65,7 +65,7 @@ def test_run_address_space_list():
     cfg['enterprise']['address_spaces']['ord'] = ['100.0.0.0/9', '100.128.0.0/9']
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, empty_exp_routes, exp_sources())
+        combine.assert_called_with(exp_address_spaces, empty_exp_routes, exp_sources(), workers=1)
 
 
 def test_run_route_sources_not_list():
@@ -75,7 +75,7 @@ def test_run_route_sources_not_list():
     exp_routes['ord', 'lax'] = set(['fw1.ord'])
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.ord'))
+        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.ord'), workers=1)
 
 
 def test_run_route_with_invalid_space():
@@ -96,7 +96,7 @@ def test_run_star_source():
     exp_routes['unmanaged', 'lax'] = set(['fw1.lax'])
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'))
+        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'), workers=1)
 
 
 def test_run_star_dest():
@@ -109,7 +109,7 @@ def test_run_star_dest():
     exp_routes['lax', 'unmanaged'] = set(['fw1.lax'])
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'))
+        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'), workers=1)
 
 
 def test_run_bidirectional():
@@ -126,4 +126,12 @@ def test_run_bidirectional():
     exp_routes['lax', 'unmanaged'] = set(['fw1.lax'])
     with patched_combine() as combine:
         scripts.run(cfg['enterprise'], cfg)
-        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'))
+        combine.assert_called_with(exp_address_spaces, exp_routes, exp_sources('fw1.lax'), workers=1)
+
+
+def test_run_workers():
+    cfg = copy.deepcopy(base_cfg)
+    cfg['enterprise']['workers'] = 4
+    with patched_combine() as combine:
+        scripts.run(cfg['enterprise'], cfg)
+        combine.assert_called_with(exp_address_spaces, empty_exp_routes, exp_sources(), workers=4)
@@ -63,3 +63,20 @@ def test_simplify_combine_iterations():
           IPSet([IP('20.0.0.0'), IP('30.0.0.0'), IP('40.0.0.0')])),
     ]}
     eq_(simplify_rules(rules), exp)
+
+
+def test_simplify_combine_groups():
+    """All rules with the same destination are combined at once, and the
+    result is sorted by destination"""
+    rules = {'testapp': [
+        r('10.0.0.0', '40.0.0.0', name='c'),
+        r('11.0.0.0', '30.0.0.0', name='b'),
+        r('12.0.0.0', '30.0.0.0', name='a'),
+        r('13.0.0.0', '30.0.0.0', name='b'),
+    ]}
+    exp = {'testapp': [
+        r(IPSet([IP('11.0.0.0'), IP('12.0.0.0'), IP('13.0.0.0')]),
+          '30.0.0.0', name='a+b'),
+        r('10.0.0.0', '40.0.0.0', name='c'),
+    ]}
+    eq_(simplify_rules(rules), exp)
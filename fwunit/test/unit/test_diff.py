@@ -116,6 +116,33 @@ def test_app_diff_reorg_rules():
     ]
     eq_(list(diff.app_diff('http', l, r)), [])
 
+
+def test_app_diff_identical_rules():
+    l = [
+        Rule(src=TEN,    dst=TWENTY, app='http', name='10->20'),
+        Rule(src=TWENTY, dst=TEN,    app='http', name='20->10'),
+    ]
+    r = [
+        Rule(src=TWENTY, dst=TEN,    app='http', name='20->10 renamed'),
+        Rule(src=TEN,    dst=TWENTY, app='http', name='10->20'),
+    ]
+    eq_(list(diff.app_diff('http', l, r)), [])
+
+
+def test_app_diff_identical_rule_covers_change():
+    # a rule in both sides still covers changes to other rules
+    l = [
+        Rule(src=TEN,   dst=TWENTY,   app='http', name='10->20'),
+        Rule(src=TEN_0, dst=TWENTY_0, app='http', name='10.0/17->20.0/17'),
+    ]
+    r = [
+        Rule(src=TEN,   dst=TWENTY,   app='http', name='10->20'),
+        Rule(src=TEN,   dst=TWENTY_0, app='http', name='10->20.0/17'),
+        Rule(src=TWENTY, dst=TEN,     app='http', name='20->10'),
+    ]
+    eq_(list(diff.app_diff('http', l, r)),
+        [('+', 'http', TWENTY, TEN)])
+
 def test_make_diff():
     eq_(sorted(diff.make_diff(FakeSource(LEFT), FakeSource(RIGHT))), sorted([
         # expand stage from /25 to /24
@@ -2,8 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
+import mock
+import pickle
+from fwunit import ip
 from fwunit.ip import IP, IPSet, IPPairs
+from fwunit.test.util import ipset
 from nose.tools import assert_false
+from nose.tools import assert_raises
 from nose.tools import assert_true
 from nose.tools import eq_
 
@@ -80,8 +86,27 @@ def test_ippairs():
         IPPairs())
     eq_(IPPairs((ten, ten)) - IPPairs((ten26, ten26)),
         IPPairs((ten, ten - ten26), (ten - ten26, ten26)))
-        # TODO: equivalent to, but doesn't compare equal to:
-        #  IPPairs((ten - ten26, ten), (ten26, ten - ten26)))
+    eq_(IPPairs((ten, ten)) - IPPairs((ten26, ten26)),
+        IPPairs((ten - ten26, ten), (ten26, ten - ten26)))
+
+def test_ippairs_iter():
+    ten = IPSet([IP('10.0.0.0/8')])
+    ten26 = IPSet([IP('10.26.0.0/16')])
+    twenty = IPSet([IP('20.0.0.0/8')])
+    # pairs are merged by destination, with disjoint sources
+    eq_(list(IPPairs((ten, twenty), (ten26, ten), (twenty, twenty))),
+        [(ten - ten26 + twenty, twenty), (ten26, ten + twenty)])
+    eq_(list(IPPairs((ten, IPSet()), (IPSet(), ten))), [])
+    assert_false(IPPairs((ten, twenty)) - IPPairs((ten, twenty)))
+
+
+def test_ippairs_eq_other_types():
+    ten = IPSet([IP('10.0.0.0/8')])
+    pairs = IPPairs((ten, ten))
+    assert_false(pairs == None)
+    assert_false(pairs == [(ten, ten)])
+    assert pairs != None
+    assert not (pairs != IPPairs((ten, ten)))
 
 def test_ippairs_sub_empty():
     ten = IPSet([IP('10.0.0.0/8')])
@@ -92,3 +117,163 @@ def test_ippairs_sub_empty():
             IPPairs((ten, twenty), (twenty, ten)),
         ]:
         eq_(pairs - IPPairs(), pairs)
+
+
+def test_ippairs_differences():
+    ten = IPSet([IP('10.0.0.0/8')])
+    ten26 = IPSet([IP('10.26.0.0/16')])
+    twenty = IPSet([IP('20.0.0.0/8')])
+    left = IPPairs((ten, ten), (twenty, ten))
+    right = IPPairs((ten26, ten + twenty), (twenty, ten))
+    eq_(left.differences(right), (left - right, right - left))
+    eq_(left.differences(right),
+        (IPPairs((ten - ten26, ten)), IPPairs((ten26, twenty))))
+    eq_(left.differences(left), (IPPairs(), IPPairs()))
+
+
+def test_ippairs_shared_dsts():
+    ten = IPSet([IP('10.0.0.0/8')])
+    ten26 = IPSet([IP('10.26.0.0/16')])
+    ten27 = IPSet([IP('10.27.0.0/16')])
+    twenty = IPSet([IP('20.0.0.0/8')])
+    # adjacent and overlapping sources with the same destination
+    eq_(IPPairs((ten26, twenty), (ten27, twenty), (ten26, ten), (ten, twenty)),
+        IPPairs((ten, twenty), (ten26, ten)))
+    eq_(list(IPPairs((ten26, twenty), (ten27, twenty))),
+        [(ten26 + ten27, twenty)])
+
+def test_ipset_ranges():
+    s = IPSet([IP('10.0.0.0/24'), IP('10.0.1.0/24'), IP('10.0.3.0/24')])
+    eq_(s.ranges, [(0x0a000000, 0x0a000200), (0x0a000300, 0x0a000400)])
+    eq_(IPSet.from_ranges(s.ranges), s)
+    eq_(IPSet.from_ranges([(5, 10), (0, 6), (10, 11)]).ranges, [(0, 11)])
+
+
+def test_ipset_prefixes():
+    eq_(IPSet.from_ranges([(0x0a000001, 0x0a000004)]).prefixes,
+        [IP('10.0.0.1'), IP('10.0.0.2/31')])
+    eq_(IPSet([IP('0.0.0.0/0')]).prefixes, [IP('0.0.0.0/0')])
+    eq_(IPSet([IP('0.0.0.0/1'), IP('128.0.0.0/1')]).prefixes, [IP('0.0.0.0/0')])
+    eq_(IPSet().prefixes, [])
+
+
+def test_ipset_add_sub():
+    any = IPSet([IP('0.0.0.0/0')])
+    ten = IPSet([IP('10.0.0.0/8')])
+    ten26 = IPSet([IP('10.26.0.0/16')])
+    eq_((any - ten) + ten, any)
+    eq_(ten - ten26 - ten, IPSet())
+    eq_((ten - ten26).prefixes[:2], [IP('10.0.0.0/12'), IP('10.16.0.0/13')])
+    eq_(len(ten - ten26), 2 ** 24 - 2 ** 16)
+    eq_(ten26 - IPSet(), ten26)
+    eq_(IPSet() - ten26, IPSet())
+
+
+def test_ipset_interned():
+    ten = IPSet([IP('10.0.0.0/8')])
+    assert_true(IPSet([IP('10.0.0.0/9'), IP('10.128.0.0/9')]) is ten)
+    assert_true(IPSet.from_ranges([(10 << 24, 11 << 24)]) is ten)
+    assert_true(IPSet(ten) is ten)
+    assert_true((ten + ten) is ten)
+    assert_true(pickle.loads(pickle.dumps(ten, 2)) is ten)
+    assert_true(copy.deepcopy(ten) is ten)
+    eq_(len(set([ten, IPSet([IP('10.0.0.0/8')]), IPSet()])), 2)
+    eq_({ten: 1}[IPSet([IP('10.0.0.0/8')])], 1)
+
+
+def test_ipset_immutable():
+    ten = IPSet([IP('10.0.0.0/8')])
+    assert_raises(TypeError, lambda: ten.add(IP('11.0.0.0/8')))
+    assert_raises(TypeError, lambda: ten.discard(IP('10.0.0.0/8')))
+    s = ten
+    s += IPSet([IP('11.0.0.0/8')])
+    eq_(ten, IPSet([IP('10.0.0.0/8')]))
+
+
+def test_memoize_operations():
+    ten = IPSet([IP('10.0.0.0/8')])
+    ten26 = IPSet([IP('10.26.0.0/16')])
+    eleven = IPSet([IP('11.0.0.0/8')])
+    memo = ip.memoize_operations(2)
+    try:
+        eq_(ten - ten26, ten - ten26)
+        eq_((memo.hits, memo.misses), (1, 1))
+        eq_(ten & ten26, ten26)
+        eq_(ten + eleven, IPSet([IP('10.0.0.0/7')]))
+        # the difference was least recently used, and was evicted
+        eq_(len(ten - ten26), 2 ** 24 - 2 ** 16)
+        eq_((memo.hits, memo.misses), (1, 4))
+        eq_(ten & ten26, ten26)
+        eq_((memo.hits, memo.misses), (1, 5))
+    finally:
+        ip.memoize_operations(0)
+    assert_true(ip._memo is None)
+
+
+def test_ipset_contains():
+    s = IPSet([IP('10.0.0.0/8')]) - IPSet([IP('10.1.2.3')])
+    assert_true(IP('10.1.2.4') in s)
+    assert_true(IP('10.2.0.0/16') in s)
+    assert_false(IP('10.1.2.3') in s)
+    assert_false(IP('10.1.0.0/16') in s)
+    assert_false(IP('11.0.0.0') in s)
+
+
+
+def test_ipset_ipv6_ignored():
+    s = IPSet([IP('10.0.0.0/8'), IP('2001:db8::/32')])
+    eq_(s, IPSet([IP('10.0.0.0/8')]))
+    eq_(s & IPSet([IP('0.0.0.0/0')]), IPSet([IP('10.0.0.0/8')]))
+    eq_(IPSet([IP('2001:db8::/32')]), IPSet())
+    assert_false(IP('2001:db8::1') in s)
+
+OVERLAP_LEFTS = [
+    (ipset('10.0.0.0/8'), ipset('20.0.0.0/8')),
+    (ipset('10.1.0.0/16', '30.0.0.0/8'), ipset('20.1.2.3')),
+    (ipset('40.0.0.0/8'), ipset('0.0.0.0/0')),
+    (IPSet(), ipset('0.0.0.0/0')),
+]
+OVERLAP_RIGHTS = [
+    (ipset('10.1.2.0/24'), ipset('20.1.0.0/16')),
+    (ipset('30.5.0.0/16'), ipset('20.1.2.4')),
+    (ipset('0.0.0.0/0'), ipset('20.0.0.0/8')),
+]
+OVERLAP_EXPECTED = [(0, 0), (0, 2), (1, 0), (1, 2), (2, 2)]
+
+
+def test_overlapping_pairs():
+    eq_(ip.overlapping_pairs(OVERLAP_LEFTS, OVERLAP_RIGHTS), OVERLAP_EXPECTED)
+    eq_(ip.overlapping_pairs([], OVERLAP_RIGHTS), [])
+    eq_(ip.overlapping_pairs(OVERLAP_LEFTS, []), [])
+
+
+def test_overlapping_pairs_chunked():
+    with mock.patch.object(ip.IPSetArray, 'chunk_size', 1):
+        eq_(ip.overlapping_pairs(OVERLAP_LEFTS, OVERLAP_RIGHTS), OVERLAP_EXPECTED)
+
+
+def test_overlapping_pairs_no_numpy():
+    with mock.patch.object(ip, 'numpy', None):
+        eq_(ip.overlapping_pairs(OVERLAP_LEFTS, OVERLAP_RIGHTS), OVERLAP_EXPECTED)
+
+
+def test_overlapping_pairs_indexed():
+    with mock.patch.object(ip, 'max_tested_pairs', 0):
+        eq_(ip.overlapping_pairs(OVERLAP_LEFTS, OVERLAP_RIGHTS), OVERLAP_EXPECTED)
+        eq_(ip.overlapping_pairs([(ipset('10.0.0.0/8'),)], [(IPSet(),)]), [])
+
+
+def test_ipsetindex_overlapping():
+    sets = [
+        ipset('10.0.0.0/8'),
+        ipset('10.1.0.0/16', '30.0.0.0/8'),
+        ipset('0.0.0.0/0'),
+        IPSet(),
+        ipset('10.1.2.3', '40.0.0.0/8'),
+    ]
+    index = ip.IPSetIndex(sets)
+    for query in [ipset('10.1.2.3'), ipset('30.1.1.1', '40.0.0.0/16'),
+                  ipset('20.0.0.0/8'), IPSet(), ipset('0.0.0.0/0')]:
+        eq_(index.overlapping(query),
+            [i for i, s in enumerate(sets) if not s.isdisjoint(query)])
+    eq_(ip.IPSetIndex([]).overlapping(ipset('0.0.0.0/0')), [])
@@ -0,0 +1,88 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+from fwunit import rulefile
+from fwunit.ip import IPSet
+from fwunit.test.util import ipset
+from fwunit.test.util.test_rules import TEST_RULES
+from fwunit.types import Rule
+from nose.tools import eq_, assert_raises
+
+dir = None
+
+
+def setup_module():
+    global dir
+    dir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(dir)
+
+
+def test_json_roundtrip():
+    filename = os.path.join(dir, 'rules.json')
+    rulefile.write_rules(TEST_RULES, filename)
+    eq_(rulefile.load_rules(filename), TEST_RULES)
+
+
+def test_binary_roundtrip():
+    filename = os.path.join(dir, 'rules.bin')
+    rulefile.write_rules(TEST_RULES, filename, 'binary')
+    eq_(open(filename).read(8), rulefile.MAGIC)
+    eq_(rulefile.load_rules(filename), TEST_RULES)
+
+
+def test_binary_edge_cases():
+    rules = {
+        u'caf\xe9': [
+            Rule(src=IPSet([]), dst=ipset('0.0.0.0/0'), app=u'caf\xe9',
+                 name=u'n\xe9'),
+            Rule(src=ipset('255.255.255.255'), dst=ipset('0.0.0.0'),
+                 app=u'caf\xe9', name=u''),
+        ],
+        'empty': [],
+    }
+    filename = os.path.join(dir, 'edge.bin')
+    rulefile.write_rules(rules, filename, 'binary')
+    eq_(rulefile.load_rules(filename), rules)
+
+
+def test_binary_shares_ipsets():
+    shared = ipset('10.0.0.0/8')
+    rules = {
+        'a': [Rule(src=shared, dst=ipset('10.1.0.0/16'), app='a', name='r')],
+        'b': [Rule(src=shared, dst=shared, app='b', name='r')],
+    }
+    filename = os.path.join(dir, 'shared.bin')
+    rulefile.write_rules(rules, filename, 'binary')
+    rf = rulefile.BinaryRuleFile(filename)
+    eq_(sorted(rf.apps()), ['a', 'b'])
+    a, = rf.rules_for_app('a')
+    b, = rf.rules_for_app('b')
+    assert a.src is b.src is b.dst
+    eq_(a.src, shared)
+
+
+def test_unknown_format():
+    assert_raises(ValueError, lambda:
+        rulefile.write_rules(TEST_RULES, os.path.join(dir, 'x'), 'xml'))
+
+
+def test_lazy_decodes_on_access():
+    for format in rulefile.FORMATS:
+        filename = os.path.join(dir, 'lazy.' + format)
+        rulefile.write_rules(TEST_RULES, filename, format)
+        rules = rulefile.load_rules(filename, lazy=True)
+        eq_(sorted(rules), sorted(TEST_RULES))
+        assert 'ssh' in rules and 'nosuch' not in rules
+        eq_([app for app, r in rules._rules.iteritems() if r is not None], [])
+        eq_(rules['ssh'], TEST_RULES['ssh'])
+        eq_([app for app, r in rules._rules.iteritems() if r is not None], ['ssh'])
+        assert rules['ssh'] is rules['ssh']
+        eq_(rules.get('nosuch', []), [])
+        eq_(dict(rules), TEST_RULES)
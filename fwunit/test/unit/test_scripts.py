@@ -0,0 +1,23 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import mock
+from nose.tools import assert_raises, eq_
+from fwunit import ip
+from fwunit import scripts
+
+
+def test_main_memo_disabled_on_error():
+    # a source that fails still leaves IPSet operations unmemoized
+    cfg = {'broken': {'type': 'broken', 'output': 'broken.json',
+                      'ipset_memo': 100}}
+    args = argparse.Namespace(sources=[], boto_verbose=False)
+    ep = mock.Mock()
+    ep.name = 'broken'
+    ep.load.return_value.side_effect = RuntimeError('oops')
+    with mock.patch('fwunit.scripts._setup', return_value=(args, cfg)), \
+            mock.patch('pkg_resources.iter_entry_points', return_value=[ep]):
+        assert_raises(RuntimeError, scripts.main)
+    eq_(ip._memo, None)
@@ -2,10 +2,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import mock
 import xml.etree.ElementTree as ET
+from cStringIO import StringIO
 from fwunit.ip import IP, IPSet
 from fwunit.srx import parse
-from nose.tools import eq_
+from nose.tools import assert_almost_equal, eq_, ok_
 from fwunit.test.util.srx_xml import route_xml_blackhole
 from fwunit.test.util.srx_xml import route_xml_11_4R6
 from fwunit.test.util.srx_xml import zones_empty_xml
@@ -136,6 +138,36 @@ def test_parse_addrbook_attached():
     eq_(z.addresses['trustedhost'], IPSet([IP('10.0.9.2')]))
 
 
+
+def test_parse_zone_ipv6_address():
+    f = FakeSRX()
+    z = f.add_zone('untrust')
+    f.add_address(z, 'host1', '9.0.9.1/32')
+    f.add_address(z, 'host1-v6', '2001:db8::1/128')
+    f.add_address_set(z, 'hosts', 'host1', 'host1-v6')
+    f.add_interface(z, 'reth0')
+
+    elt = parse_xml(
+        f.fake_show('configuration security zones'), './/security-zone')
+    z = parse.Zone._from_xml(elt)
+    # fwunit only handles IPv4, so IPv6 addresses are empty
+    eq_(z.addresses['host1-v6'], IPSet([]))
+    eq_(z.addresses['hosts'], IPSet([IP('9.0.9.1')]))
+
+
+def test_parse_addrbook_ipv6_address():
+    f = FakeSRX()
+    ab = f.add_addrbook('global')
+    f.add_address(ab, 'host1', '9.0.9.1/32')
+    f.add_address(ab, 'net-v6', '2001:db8::/32')
+    f.add_address_set(ab, 'hosts', 'host1', 'net-v6')
+
+    elt = parse_xml(
+        f.fake_show('configuration security address-book'), './/address-book')
+    z = parse.AddressBook._from_xml(elt)
+    eq_(z.addresses['net-v6'], IPSet([]))
+    eq_(z.addresses['hosts'], IPSet([IP('9.0.9.1')]))
+
 def test_parse_zones_empty():
     elt = parse_xml(zones_empty_xml, './/security-zone')
     z = parse.Zone._from_xml(elt)
@@ -157,3 +189,43 @@ def test_parse_route_11_4R6():
     eq_(r.destination, IP('0.0.0.0/0'))
     eq_(r.interface, 'reth0.10')
     eq_(r.is_local, False)
+
+
+def test_throttle_delay():
+    throttle = parse.Throttle(ratio=2.0, minimum=0.1)
+    # first request sets the baseline
+    assert_almost_equal(throttle.delay(1.0, 1000), 2.0)
+    # a faster response establishes better latency and throughput
+    assert_almost_equal(throttle.delay(0.5, 10), 1.0)
+    assert_almost_equal(throttle.delay(0.6, 2000), 1.2)
+    # a response slower than expected backs off
+    assert_almost_equal(throttle.delay(1.1, 10), 2.0 * 1.1 * (1.1 / (0.5 + 10 / 20000.)))
+    # tiny responses still wait for the minimum
+    assert_almost_equal(throttle.delay(0.0, 0), 0.2)
+    assert_almost_equal(parse.Throttle(ratio=0).delay(5.0, 10), 0)
+
+
+def test_iterparse():
+    xml = ('<a xmlns="urn:x"><b><c>1</c></b><d/><b><c>2</c></b>'
+           '<e><b><c>3</c></b></e></a>')
+    seen = []
+    for elt in parse.iterparse(StringIO(xml), 'b'):
+        eq_(elt.tag, 'b')
+        seen.append(elt.findtext('c'))
+        # earlier elements have already been discarded or cleared
+        eq_([e for e in elt.itersiblings(preceding=True) if len(e)], [])
+        ok_(len(list(elt.itersiblings(preceding=True))) <= 2)
+    eq_(seen, ['1', '2', '3'])
+
+
+def test_parse_routes_only_inet0():
+    f = FakeSRX()
+    xml = parse_xml(f.fake_show('route'))
+    other = ET.fromstring(ET.tostring(xml.find('.//route-table')))
+    other.find('table-name').text = 'inet6.0'
+    xml.find('.//route-information').insert(0, other)
+    conn = mock.Mock()
+    conn.stream.return_value = StringIO(ET.tostring(xml))
+    fw = parse.Firewall()
+    eq_([str(r) for r in fw._parse_routes(conn)],
+        ['0.0.0.0/0 via reth0', '10.0.0.0/8 via reth1'])
@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from nose.tools import eq_
+import mock
 from fwunit.srx import parse
 from fwunit.srx import process
 from fwunit.common import ApplicationMap
@@ -28,7 +29,7 @@ def mkpol(**kwargs):
         setattr(pol, k, v)
     return pol
 
-def call_process_rules(app_map, policies, zone_nets):
+def call_process_rules(app_map, policies, zone_nets, workers=1, state=None):
     # calculate a few of the extra inputs
     policies_by_zone_pair = {}
     for pol in policies:
@@ -38,7 +39,7 @@ def call_process_rules(app_map, policies, zone_nets):
     dst_per_policy = {pol: pol.destination_addresses for pol in policies}
     res = process.process_rules(app_map, policies, zone_nets,
                                 policies_by_zone_pair, src_per_policy,
-                                dst_per_policy)
+                                dst_per_policy, workers=workers, state=state)
     [ruleset.sort() for ruleset in res.itervalues()]
     return res
 
@@ -125,6 +126,85 @@ def test_process_global_priority():
     eq_(res, exp)
 
 
+def test_process_rules_workers():
+    # processing zone pairs in worker processes gives the same result
+    policies = [
+        mkpol(name='admin', from_zone='pvt', to_zone='dmz',
+            src_addrs=ipset('192.168.1.128/32'), dst_addrs=ipset('0.0.0.0/0'),
+            applications=['any']),
+        mkpol(name='http', from_zone='pub', to_zone='dmz',
+            src_addrs=ipset('0.0.0.0/0'), dst_addrs=ipset('10.1.10.0/24'),
+            applications=['web']),
+        mkpol(name='deny-ssh-global', from_zone=None, to_zone=None,
+            src_addrs=ipset('0.0.0.0/0'), dst_addrs=ipset('10.1.0.0/16'),
+            applications=['junos-ssh'], sequence=1, action='deny'),
+        mkpol(name='ssh-global', from_zone=None, to_zone=None,
+            src_addrs=ipset('0.0.0.0/0'), dst_addrs=ipset('0.0.0.0/0'),
+            applications=['junos-ssh'], sequence=2),
+    ]
+    eq_(call_process_rules(APP_MAP, policies, ZONE_NETS, workers=2),
+        call_process_rules(APP_MAP, policies, ZONE_NETS))
+
+
+def test_process_zone_pair_app_classes():
+    # apps matched by the same policies are only processed once
+    zpolicies = [
+        (mkpol(name='ssh', applications=['junos-ssh'], src_addrs=None,
+               dst_addrs=None), ipset('192.168.1.0/24'), ipset('10.1.0.0/16')),
+        (mkpol(name='any', applications=['any'], src_addrs=None,
+               dst_addrs=None), ipset('192.168.0.0/16'), ipset('10.0.0.0/8')),
+    ]
+    all_apps = set(['junos-ssh', 'junos-ping', 'web'])
+    app_map = ApplicationMap({'application-map': {'junos-ssh': 'ssh'}})
+    with mock.patch('fwunit.srx.process._process_policies',
+                    wraps=process._process_policies) as process_policies:
+        res = dict(process.process_zone_pair(
+            app_map, all_apps, 'pvt', 'dmz', ZONE_NETS['pvt'],
+            ZONE_NETS['dmz'], zpolicies))
+    eq_(process_policies.call_count, 2)
+    eq_(sorted(res), ['@@other', 'junos-ping', 'ssh', 'web'])
+    eq_(res['web'], [Rule(ipset('192.168.0.0/16'), ipset('10.0.0.0/8'),
+                          'web', 'any')])
+    eq_(res['@@other'], [r._replace(app='@@other') for r in res['web']])
+    eq_(sorted(res['ssh']), sorted([
+        Rule(ipset('192.168.1.0/24'), ipset('10.1.0.0/16'), 'ssh', 'ssh'),
+        Rule(ipset('192.168.1.0/24'), ipset('10.0.0.0/8') - ipset('10.1.0.0/16'),
+             'ssh', 'any'),
+        Rule(ipset('192.168.0.0/16') - ipset('192.168.1.0/24'), ipset('10.0.0.0/8'),
+             'ssh', 'any'),
+    ]))
+
+
+def test_process_rules_incremental():
+    # with state, only changed zone pairs are recomputed
+    policies = [
+        mkpol(name='admin', from_zone='pvt', to_zone='dmz',
+            src_addrs=ipset('192.168.1.128/32'), dst_addrs=ipset('0.0.0.0/0'),
+            applications=['junos-ssh']),
+        mkpol(name='http', from_zone='pub', to_zone='dmz',
+            src_addrs=ipset('0.0.0.0/0'), dst_addrs=ipset('10.1.10.0/24'),
+            applications=['web']),
+    ]
+    state = {}
+    with mock.patch.object(process, 'process_zone_pair',
+                           wraps=process.process_zone_pair) as pzp:
+        first = call_process_rules(APP_MAP, policies, ZONE_NETS, state=state)
+        eq_(pzp.call_count, 9)
+        eq_(sorted(state), sorted((f, t) for f in ZONE_NETS for t in ZONE_NETS))
+
+        pzp.reset_mock()
+        eq_(call_process_rules(APP_MAP, policies, ZONE_NETS, state=state), first)
+        eq_(pzp.call_count, 0)
+
+        pzp.reset_mock()
+        policies[1].destination_addresses = ipset('10.1.20.0/24')
+        res = call_process_rules(APP_MAP, policies, ZONE_NETS, state=state)
+        eq_([c[0][2:4] for c in pzp.call_args_list], [('pub', 'dmz')])
+    eq_(res, call_process_rules(APP_MAP, policies, ZONE_NETS))
+    eq_(res['web'], [Rule(src=ipset('128.135.0.0/16'), dst=ipset('10.1.20.0/24'),
+                          app='web', name='http')])
+
+
 def mkroute(**kwargs):
     kwargs['destination'] = IP(kwargs['destination'])
     kwargs.setdefault('is_local', False)
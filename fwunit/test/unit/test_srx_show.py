@@ -18,3 +18,14 @@ def test_show_ok(SSHClient):
     SSHClient().set_missing_host_key_policy.assert_called_with(mock.ANY)
     SSHClient().connect.assert_called_with('fw', username='uu', password='pp')
     SSHClient().exec_command.assert_called_with('show route | display xml | no-more\n', timeout=240.0)
+
+
+@mock.patch('paramiko.SSHClient')
+def test_stream(SSHClient):
+    xml = '<rpc-reply>\n</rpc-reply>'
+    stdout = StringIO(xml)
+    SSHClient().exec_command.return_value = StringIO(), stdout, StringIO()
+
+    cfg = dict(firewall = 'fw', ssh_username = 'uu', ssh_password = 'pp')
+    eq_(show.Connection(cfg).stream('route'), stdout)
+    SSHClient().exec_command.assert_called_with('show route | display xml | no-more\n', timeout=240.0)
@@ -0,0 +1,56 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import random
+from fwunit.aws.snapshot import Snapshot
+
+PORTS = [
+    ('tcp', '22', '22'),
+    ('tcp', '80', '81'),
+    ('tcp', '443', '443'),
+    ('udp', '53', '53'),
+    ('tcp', '1000', '2000'),
+    ('-1', None, None),
+]
+
+
+def synthetic_account(instances=100, security_groups=10, subnets=16, seed=0):
+    """Generate a Snapshot of a random AWS account, in a single region.  One
+    subnet in four is named 'dynamic'; the rest are per-host."""
+    rand = random.Random(seed)
+    snapshot = Snapshot()
+    snapshot.regions = set(['us-east-1'])
+    cidrs = []
+    for i in range(subnets):
+        cidr = '10.{}.{}.0/24'.format(i // 256, i % 256)
+        name = 'dynamic' if i % 4 == 0 else 'perhost{}'.format(i)
+        snapshot.subnets['subnet-{}'.format(i)] = ('us-east-1', cidr, {'Name': name})
+        cidrs.append(cidr)
+
+    sgids = ['sg-{}'.format(i) for i in range(security_groups)]
+
+    def sgrules():
+        rules = []
+        for _ in range(rand.randrange(1, 4)):
+            grants = []
+            for _ in range(rand.randrange(1, 3)):
+                if rand.random() < 0.5:
+                    grants.append((rand.choice(
+                        ['0.0.0.0/0', '10.0.0.0/8', '192.168.0.0/16',
+                         '10.0.{}.0/24'.format(rand.randrange(subnets))]), None))
+                else:
+                    grants.append((None, rand.choice(sgids)))
+            rules.append(rand.choice(PORTS) + (grants,))
+        return rules
+    for sgid in sgids:
+        snapshot.security_groups['us-east-1', sgid] = (
+            'group-' + sgid, sgrules(), sgrules())
+
+    for i in range(instances):
+        net = rand.choice(cidrs).rsplit('.', 1)[0]
+        ip = '{}.{}'.format(net, rand.randrange(1, 255))
+        groups = rand.sample(sgids, rand.randrange(1, min(4, security_groups + 1)))
+        snapshot.instances['i-{}'.format(i)] = (
+            'us-east-1', 'running', 'vpc-1', ip, groups, {'Name': 'host{}'.format(i)})
+    return snapshot
@@ -0,0 +1,50 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import random
+from fwunit.ip import IP, IPSet
+from fwunit.types import Rule
+
+ADDRESS_SPACES = {
+    'ten': IPSet([IP('10.0.0.0/8')]),
+    'twenty': IPSet([IP('20.0.0.0/8')]),
+    'unmanaged': IPSet([IP('0.0.0.0/0')]) - IPSet([IP('10.0.0.0/8'), IP('20.0.0.0/8')]),
+}
+
+ROUTES = {
+    ('ten', 'ten'): ['fw1.ten'],
+    ('ten', 'twenty'): ['fw1.ten', 'fw1.twenty'],
+    ('ten', 'unmanaged'): ['fw1.ten'],
+    ('twenty', 'ten'): ['fw1.ten', 'fw1.twenty'],
+    ('twenty', 'twenty'): ['fw1.twenty'],
+    ('twenty', 'unmanaged'): ['fw1.twenty'],
+    ('unmanaged', 'ten'): ['fw1.ten'],
+    ('unmanaged', 'twenty'): ['fw1.twenty'],
+    ('unmanaged', 'unmanaged'): [],
+}
+
+
+def synthetic_sources(rules=1000, apps=5, seed=0):
+    """Generate random rules for the 'fw1.ten' and 'fw1.twenty' sources, which
+    combine using ADDRESS_SPACES and ROUTES, with the given number of rules
+    in each source."""
+    rand = random.Random(seed)
+
+    def ipset(first_octets):
+        prefixlen = rand.choice([16, 20, 24, 24, 28, 32])
+        addr = (rand.choice(first_octets) << 24) + rand.randrange(1 << 24)
+        return IPSet([IP(addr).make_net(prefixlen)])
+
+    app_names = ['app{}'.format(i) for i in range(apps)] + ['@@other']
+    sources = {}
+    for name, octet in ('fw1.ten', 10), ('fw1.twenty', 20):
+        source = sources[name] = {}
+        for i in range(rules):
+            app = rand.choice(app_names)
+            src, dst = ipset([octet]), ipset([10, 20, 30])
+            if rand.random() < 0.5:
+                src, dst = dst, src
+            source.setdefault(app, []).append(
+                Rule(src=src, dst=dst, app=app, name='{}-{}'.format(name, i)))
+    return sources
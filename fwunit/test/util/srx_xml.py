@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import mock
+from cStringIO import StringIO
 from fwunit.srx import show
 
 # fake XML results derived from the output of a Juniper SRX
@@ -299,6 +300,46 @@ policy_xml = """\
 </rpc-reply>
 """
 
+all_policies_xml = """\
+<rpc-reply xmlns:junos="http://xml.juniper.net/junos/12.1X44/junos">
+    <multi-routing-engine-results>
+        <multi-routing-engine-item>
+            <re-name>node1</re-name>
+            <security-policies junos:style="brief">
+%(contexts)s
+            </security-policies>
+        </multi-routing-engine-item>
+        
+    </multi-routing-engine-results>
+    <cli>
+        <banner>{primary:node1}</banner>
+    </cli>
+</rpc-reply>
+"""
+
+zone_context_tpl = """
+                <security-context>
+                    <context-information>
+                        <source-zone-name>%(from_zone)s</source-zone-name>
+                        <destination-zone-name>%(to_zone)s</destination-zone-name>
+                    </context-information>
+                    <policies>
+%(policies)s
+                    </policies>
+                </security-context>
+"""
+
+global_context_tpl = """
+                <security-context>
+                    <context-information>
+                        <global-context/>
+                    </context-information>
+                    <policies>
+%(policies)s
+                    </policies>
+                </security-context>
+"""
+
 no_global_policy_xml = """\
 <rpc-reply xmlns:junos="http://xml.juniper.net/junos/12.1X44/junos">
     <security-policies junos:style="brief">
@@ -370,8 +411,10 @@ class FakeSRX(object):
         self.policies = {}
         self.zones = {}
         self.address_books = {}
+        self.requests = []
 
     def fake_show(self, request):
+        self.requests.append(request)
         if request == 'route':
             return route_xml
         elif request == 'configuration security address-book':
@@ -422,7 +465,18 @@ class FakeSRX(object):
                     interfaces=interfaces))
             return zones_xml % dict(zones='\n'.join(zone_xmls))
         elif request.startswith('security policies'):
-            if request == 'security policies global':
+            if request == 'security policies':
+                # like the real thing, this includes the global policies
+                contexts = []
+                for key, policy_dicts in sorted(self.policies.iteritems()):
+                    policies = '\n'.join(policy_tpl % d for d in policy_dicts)
+                    if key == 'global':
+                        contexts.append(global_context_tpl % dict(policies=policies))
+                    else:
+                        contexts.append(zone_context_tpl % dict(
+                            from_zone=key[0], to_zone=key[1], policies=policies))
+                return all_policies_xml % dict(contexts='\n'.join(contexts))
+            elif request == 'security policies global':
                 if 'global' in self.policies:
                     policy_dicts = self.policies['global']
                     policy_xmls = [policy_tpl % d for d in policy_dicts]
@@ -447,6 +501,7 @@ class FakeSRX(object):
             'fwunit.srx.show.Connection', spec=show.Connection)
         m = self.conn_patch.start()
         m().show.side_effect = self.fake_show
+        m().stream.side_effect = lambda request: StringIO(self.fake_show(request))
 
     def uninstall(self):
         self.conn_patch.stop()
@@ -7,6 +7,7 @@
 from fwunit.ip import IPSet, IP
 from collections import namedtuple
 import itertools
+import weakref
 
 Rule = namedtuple('Rule', ['src', 'dst', 'app', 'name'])
 
@@ -23,12 +24,18 @@ def to_jsonable(rules):
             for r in itertools.chain(*rules.itervalues())]
 
 
-def ipset_from_jsonable(ipset, _cache={}):
+# IPSets are interned, so identical sets already share a single instance;
+# this just avoids re-parsing the same prefixes, for as long as the resulting
+# IPSet is in use
+_from_jsonable = weakref.WeakValueDictionary()
+
+
+def ipset_from_jsonable(ipset):
     ipset = tuple(ipset)
-    if ipset not in _cache:
-        _cache[ipset] = rv = IPSet([IP(pfx) for pfx in ipset])
-        return rv
-    return _cache[ipset]
+    rv = _from_jsonable.get(ipset)
+    if rv is None:
+        rv = _from_jsonable[ipset] = IPSet([IP(pfx) for pfx in ipset])
+    return rv
 
 
 def from_jsonable(rules):
@@ -40,6 +40,9 @@ setup(
         'docs': [
             'sphinx',
         ],
+        'numpy': [
+            'numpy',
+        ],
     },
     entry_points={
         "console_scripts": [